@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# File: cache.py
+# Brief: Load time & disk size benchmark of region cache formats
+#
+# Project: Data analysis & visualization of traffic accidents
+#
+# Authors: Jakub Bartko    xbartk07@stud.fit.vutbr.cz
+#
+# Synthetic data (see synthetic module) is stored as region caches of each
+# format -- gzip pickle, column chunks with each installed codec, memory-
+# mapped columns -- and loaded by DataDownloader.get_dict as from real
+# cache files. Column chunks are loaded by 1 thread & by thread pool.
+#
+#   ./cache.py -n 100000 1000000 -o report.json
+
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC)
+
+import numpy as np
+import colcache
+from download import DataDownloader
+from plots import environment
+from synthetic import synthetic
+
+
+def _variants():
+    """
+    Returns benchmarked variants: [(name, cache format, codec, threads)]
+    """
+    variants = [("pickle", "pickle", None, None)]
+    for codec in ["zstd", "lz4", "zlib"]:
+        try:
+            colcache.CODECS[codec]()
+        except ImportError:
+            continue
+        variants.append(("chunks-" + codec + "-1", "chunks", codec, 1))
+        variants.append(("chunks-" + codec, "chunks", codec, None))
+    variants.append(("mmap", "mmap", "none", None))
+    return variants
+
+
+def run(data, variant, folder, repeat=3):
+    """
+    Benchmarks one variant
+
+    Returns
+    -------
+    dict
+        {"variant", "rows", "write", "load" [s], "size" [B]}
+    """
+    name, fmt, codec, threads = variant
+    dd = DataDownloader(folder=folder, cache_format=fmt)
+    regions = np.unique(data["region"])
+    bounds = np.searchsorted(data["region"], regions, side="right")
+    parts = {reg: {h: col[start:stop] for h, col in data.items()}
+             for reg, start, stop in zip(regions, np.r_[0, bounds[:-1]], bounds)}
+
+    start = time.perf_counter()
+    size = 0
+    for reg, part in parts.items():
+        filename = os.path.join(folder, dd.cache_filename.format(reg))
+        if fmt == "pickle":
+            dd.write_cache(filename, part)
+        else:
+            colcache.write(filename, part, codec=codec)
+        size += os.path.getsize(filename)
+    write = time.perf_counter() - start
+
+    colcache.threads = threads
+    try:
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            loaded = DataDownloader(folder=folder, cache_format=fmt).get_dict(list(parts))
+            best = min(best or np.inf, time.perf_counter() - start)
+    finally:
+        colcache.threads = None
+    if len(loaded["p1"]) != len(data["p1"]):
+        raise RuntimeError("cache of {} lost entries".format(name))
+    return {"variant": name, "rows": len(data["p1"]), "write": write, "load": best, "size": size}
+
+
+def print_report(results, file=sys.stdout):
+    """
+    Prints results; load time & size are followed by ratio to gzip pickle
+    """
+    base = {r["rows"]: r for r in results if r["variant"] == "pickle"}
+    print("{:<16} {:>9} {:>10} {:>10} {:>9} {:>11} {:>9}".format(
+        "variant", "rows", "write [s]", "load [s]", "", "size [MB]", ""), file=file)
+    for r in results:
+        b = base.get(r["rows"])
+        print("{:<16} {:>9} {:>10.3f} {:>10.3f} {:>9} {:>11.2f} {:>9}".format(
+            r["variant"], r["rows"], r["write"], r["load"],
+            "({:.2f}x)".format(r["load"] / b["load"]) if b else "",
+            r["size"] / (1024*1024), "({:.2f}x)".format(r["size"] / b["size"]) if b else ""), file=file)
+
+
+if __name__ == "__main__":
+    aparser = argparse.ArgumentParser(
+        description="Benchmarks load time & disk size of region cache formats")
+    aparser.add_argument("-n", "--rows", type=int, nargs="+", default=[100000, 1000000],
+                         help="numbers of rows of synthetic data")
+    aparser.add_argument("-r", "--repeat", type=int, default=3,
+                         help="number of timed loads per variant; the fastest one is used")
+    aparser.add_argument("-o", "--output", help="store report as JSON")
+    args = aparser.parse_args()
+
+    results = []
+    for rows in args.rows:
+        data = synthetic(rows)
+        # as parsed by DataDownloader
+        data["region"] = data["region"].astype(str)
+        for variant in _variants():
+            with tempfile.TemporaryDirectory(prefix="izv-bench-") as folder:
+                results.append(run(data, variant, folder, args.repeat))
+    print_report(results)
+
+    if args.output:
+        env = dict(environment(), cpus=os.cpu_count())
+        for lib in ["zstandard", "lz4"]:
+            try:
+                env[lib] = __import__(lib).__version__
+            except ImportError:
+                env[lib] = None
+        with open(args.output, "w") as fp:
+            json.dump({"environment": env, "results": results}, fp, indent=1)
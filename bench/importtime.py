@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# File: importtime.py
+# Brief: Import-time budget check of the command-line entry point
+#
+# Project: Data analysis & visualization of traffic accidents
+#
+# Authors: Jakub Bartko    xbartk07@stud.fit.vutbr.cz
+
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+# module: budget of cumulative import time [ms]
+BUDGETS = {
+    "izv": 30,
+    "profiling": 30,
+    "download": 250,
+    "get_stat": 250,
+}
+
+# heavy modules that must never be loaded by importing the above
+FORBIDDEN = ["matplotlib", "seaborn", "pandas", "geopandas", "contextily", "sklearn", "requests", "bs4"]
+
+
+def measure(module, repeat=5):
+    """
+    Measures import of module in fresh interpreter using `python -X importtime`
+
+    Parameters
+    ----------
+    module: str
+        name of module from src directory
+    repeat: int
+        number of measurements; the fastest one is used
+
+    Returns
+    -------
+    tuple
+        (cumulative import time [ms], set of imported top-level packages);
+        None if the import fails
+    """
+    p = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+    best = None
+    for _ in range(repeat):
+        res = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + module],
+                             cwd=SRC, capture_output=True, text=True)
+        if res.returncode:
+            print(res.stderr.strip().splitlines()[-1], file=sys.stderr)
+            return None
+        total = 0
+        packages = set()
+        for line in res.stderr.splitlines():
+            m = p.match(line)
+            if not m:
+                continue
+            packages.add(m.group(4).split(".")[0])
+            if m.group(4) == module:
+                total = int(m.group(2)) / 1000
+        if best is None or total < best[0]:
+            best = (total, packages)
+    return best
+
+
+if __name__ == "__main__":
+    aparser = argparse.ArgumentParser(
+        description="Checks import times of project modules against budgets")
+    aparser.add_argument("-n", "--repeat", type=int, default=5,
+                         help="number of measurements per module")
+    aparser.add_argument("--scale", type=float, default=1.0,
+                         help="multiply all budgets, e.g. for slow machines")
+    args = aparser.parse_args()
+
+    failed = False
+    for module, budget in BUDGETS.items():
+        res = measure(module, args.repeat)
+        if res is None:
+            failed = True
+            print("{:<10} import failed".format(module))
+            continue
+        total, packages = res
+        heavy = sorted(set(FORBIDDEN) & packages)
+        ok = total <= budget * args.scale and not heavy
+        failed |= not ok
+        print("{:<10} {:>8.1f} ms / {:>6.1f} ms  {}{}".format(
+            module, total, budget * args.scale, "OK" if ok else "FAIL",
+            "  (imports " + ", ".join(heavy) + ")" if heavy else ""))
+
+    sys.exit(1 if failed else 0)
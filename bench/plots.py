@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# File: plots.py
+# Brief: Rendering performance benchmark of the plotting functions
+#
+# Project: Data analysis & visualization of traffic accidents
+#
+# Authors: Jakub Bartko    xbartk07@stud.fit.vutbr.cz
+#
+# Each figure of izv.FIGURES is plotted from synthetic data of increasing
+# size. Time of a run is split by profiling stages into aggregation
+# (*.aggregate, get_data, vehicle_sums), rendering (*.render) & file
+# encoding (figure.save); size of output file & peak traced memory are
+# measured in a separate run, so tracemalloc doesn't slow down timing.
+# Basemap tiles are stubbed, so the benchmark runs offline.
+#
+#   ./plots.py -n 1000 10000 100000 -o report.json
+#   ./plots.py -o new.json --compare report.json
+# Exits with 1 if any figure fails to plot.
+
+
+import argparse
+import contextlib
+import importlib
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+import warnings
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC)
+os.environ.setdefault("MPLBACKEND", "Agg")
+
+from izv import FIGURES
+from profiling import profiler
+from synthetic import synthetic
+
+
+def _offline_tiles():
+    """
+    Installs contextily which doesn't draw basemaps, before geo imports it.
+    Tile providers are the real ones (xyzservices), so a wrong provider fails
+    here as it would in the figure; contextily itself needn't be installed.
+    """
+    try:
+        import contextily as ctx
+    except ImportError:
+        import xyzservices
+        ctx = types.ModuleType("contextily")
+        ctx.providers = xyzservices.providers
+    ctx.add_basemap = lambda *args, **kwargs: None
+    sys.modules["contextily"] = ctx
+
+
+def _loaders(data, folder):
+    """
+    Returns functions building fresh input of each loader kind of izv.FIGURES
+    """
+    import pandas as pd
+    from frames import to_dataframe
+
+    pickle = os.path.join(folder, "accidents.pkl")
+    to_dataframe(data).drop(columns="date").to_pickle(pickle)
+
+    def df():
+        from analysis import get_dataframe
+        return get_dataframe(pickle)
+
+    def gdf():
+        from geo import make_geo
+        return make_geo(pd.read_pickle(pickle))
+
+    return {
+        "df": df,
+        "gdf": gdf,
+        "raw": lambda: pd.read_pickle(pickle),
+        "dict": lambda: data,
+    }
+
+
+def _plot(func, source, location):
+    # same calls as `izv.py plot`; printed tables are dropped
+    with open(os.devnull, "w") as null, contextlib.redirect_stdout(null):
+        if func.__name__ == "plot_stat":
+            func(source, fig_location=location, show_figure=False)
+        elif func.__name__ == "plot_table":
+            func(source, location)
+        else:
+            func(source, location, False)
+
+
+def _phase(name):
+    """
+    Returns phase of profiling stage: aggregate, render, save or None
+    """
+    if name == "figure.save" or name.endswith(".save"):
+        return "save"
+    if name.endswith(".render"):
+        return "render"
+    if name.endswith(".aggregate") or name in ("get_stat.get_data", "doc.vehicle_sums") or \
+            ".budgeted_" in name:
+        return "aggregate"
+    return None
+
+
+def run(name, loader, rows, folder, repeat=3):
+    """
+    Benchmarks one figure
+
+    Returns
+    -------
+    dict
+        {"figure", "rows", "aggregate", "render", "save", "other", "total" [s],
+         "file_size" [B], "peak" [B]}; "error" instead if plotting fails
+    """
+    import matplotlib.pyplot as plt
+
+    module, func, filename, _ = FIGURES[name]
+    plot = getattr(importlib.import_module(module), func)
+    location = os.path.join(folder, filename)
+    result = {"figure": name, "rows": rows}
+
+    try:
+        best = None
+        for _ in range(repeat):
+            source = loader()
+            profiler.reset()
+            profiler.enable(memory=False)
+            start = time.perf_counter()
+            try:
+                _plot(plot, source, location)
+                total = time.perf_counter() - start
+            finally:
+                profiler.disable()
+                plt.close("all")
+            phases = {"aggregate": 0.0, "render": 0.0, "save": 0.0}
+            for r in profiler.records:
+                phase = _phase(r.name)
+                if phase:
+                    phases[phase] += r.wall
+            if best is None or total < best["total"]:
+                best = dict(phases, other=max(0.0, total - sum(phases.values())), total=total)
+        result.update(best)
+        result["file_size"] = os.path.getsize(location) if os.path.exists(location) else 0
+
+        # peak memory in separate run -- tracing slows allocations down
+        source = loader()
+        tracemalloc.start()
+        base = tracemalloc.get_traced_memory()[0]
+        try:
+            _plot(plot, source, location)
+            result["peak"] = tracemalloc.get_traced_memory()[1] - base
+        finally:
+            tracemalloc.stop()
+            plt.close("all")
+    except Exception as e:
+        result["error"] = "{}: {}".format(type(e).__name__, e)
+    return result
+
+
+def environment():
+    """
+    Returns versions of Python & libraries the report was measured with
+    """
+    env = {"python": platform.python_version(), "machine": platform.machine()}
+    for lib in ["numpy", "pandas", "matplotlib", "seaborn", "geopandas", "sklearn"]:
+        try:
+            env[lib] = importlib.import_module(lib).__version__
+        except ImportError:
+            env[lib] = None
+    return env
+
+
+def print_report(results, baseline=None, file=sys.stdout):
+    """
+    Prints results; with baseline, time & size are followed by ratio to baseline
+    """
+    base = {(r["figure"], r["rows"]): r for r in (baseline or [])}
+
+    def ratio(r, key):
+        b = base.get((r["figure"], r["rows"]), {}).get(key)
+        return " ({:>5.2f}x)".format(r[key] / b) if b else ""
+
+    print("{:<11} {:>8} {:>9} {:>9} {:>9} {:>9} {:>9} {:>10} {:>9}".format(
+        "figure", "rows", "aggr [s]", "rend [s]", "save [s]", "other [s]", "total [s]",
+        "size [kB]", "peak [MB]"), file=file)
+    for r in results:
+        if "error" in r:
+            print("{:<11} {:>8}  ERROR {}".format(r["figure"], r["rows"], r["error"]), file=file)
+            continue
+        print("{:<11} {:>8} {:>9.3f} {:>9.3f} {:>9.3f} {:>9.3f} {:>9.3f}{} {:>10.1f}{} {:>9.1f}".format(
+            r["figure"], r["rows"], r["aggregate"], r["render"], r["save"], r["other"],
+            r["total"], ratio(r, "total"), r["file_size"] / 1024, ratio(r, "file_size"),
+            r["peak"] / (1024*1024)), file=file)
+
+
+if __name__ == "__main__":
+    aparser = argparse.ArgumentParser(
+        description="Benchmarks plotting functions on synthetic data of increasing size")
+    aparser.add_argument("figures", nargs="*", metavar="FIGURE",
+                         help="figures to benchmark: " + ", ".join(FIGURES) + "; all if missing")
+    aparser.add_argument("-n", "--rows", type=int, nargs="+", default=[1000, 10000, 100000],
+                         help="numbers of rows of synthetic data")
+    aparser.add_argument("-r", "--repeat", type=int, default=3,
+                         help="number of timed runs per figure & size; the fastest one is used")
+    aparser.add_argument("-o", "--output", help="store report as JSON")
+    aparser.add_argument("--compare", help="JSON report to compare with")
+    args = aparser.parse_args()
+
+    unknown = [f for f in args.figures if f not in FIGURES]
+    if unknown:
+        aparser.error("unknown figure(s): " + ", ".join(unknown))
+
+    # deprecation warnings of plotting libraries would bury the report
+    warnings.simplefilter("ignore")
+    _offline_tiles()
+
+    results = []
+    for rows in args.rows:
+        data = synthetic(rows)
+        with tempfile.TemporaryDirectory(prefix="izv-bench-") as folder:
+            loaders = _loaders(data, folder)
+            for name in args.figures or list(FIGURES):
+                results.append(run(name, loaders[FIGURES[name][3]], rows, folder, args.repeat))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as fp:
+            baseline = json.load(fp)["results"]
+    print_report(results, baseline)
+
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump({"environment": environment(), "results": results}, fp, indent=1)
+
+    # figures not measured must not pass unnoticed
+    failed = sorted({r["figure"] for r in results if "error" in r})
+    if failed:
+        print("ERROR: failed to plot", ", ".join(failed), file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# File: aggregates.py
+# Brief: Materialised aggregates of accident data with incremental refresh
+#
+# Project: Data analysis & visualization of traffic accidents
+#
+# Authors: Jakub Bartko    xbartk07@stud.fit.vutbr.cz
+#
+# Aggregates used by plots are kept in a store next to the data archives:
+#   conditions  (region, month, p18) -> accidents       analysis.plot_conditions
+#   types       (region, p24)        -> accidents       get_stat.get_data
+#   vehicles    (region, p44)        -> accidents, p13a, p13b, p13c,
+#                                       accidents with injury  doc.plot_table
+# Along with them, the store keeps a slim ledger of counted entries (ID,
+# hash of CSV line & aggregated attributes) and size & mtime of each
+# processed archive. On refresh, only new or changed archives are read, and
+# only their lines with unknown ID or changed content are parsed; old
+# contributions of changed entries are subtracted before adding new ones.
+# Entries of archives removed from the folder, or withdrawn from a changed
+# archive, are subtracted as well.
+
+
+import gzip
+import os
+import pickle
+import zlib
+import numpy as np
+from download import DataDownloader
+from profiling import stage
+
+
+# attributes stored in ledger
+SLIM = ["p1", "p2a", "p18", "p24", "p44", "p13a", "p13b", "p13c"]
+
+
+def _archive_key(name):
+    """
+    Returns (year * 100 + month) of archive; yearly archive has month 13
+    """
+    year, month = DataDownloader.archive_date(name)
+    return year * 100 + month
+
+
+class Aggregates:
+    """
+    Store of aggregates refreshed incrementally from data archives
+
+    Attributes:
+    -----------
+        folder
+            folder with data archives
+        filename
+            path of store file; store is not persisted if missing
+        manifest
+            dict of processed archives: {archive: (size, mtime)}
+        ledger
+            dict of counted entries sorted by ID: {attribute: np.array}
+        tables
+            dict of aggregates: {name: {key tuple: tuple of values}}
+    """
+
+    regions = list(DataDownloader.regions)
+
+    def __init__(self, folder="data", filename="aggregates.pkl.gz"):
+        """
+        Parameters
+        ----------
+        folder: str
+            folder with data archives
+        filename: str
+            name of store file in folder; store is not persisted if None
+        """
+        self.folder = folder
+        self.filename = os.path.join(folder, filename) if filename else None
+        self.manifest = dict()
+        self.ledger = self._empty_ledger()
+        self.tables = {"conditions": dict(), "types": dict(), "vehicles": dict()}
+
+        if self.filename and os.path.exists(self.filename):
+            try:
+                with gzip.open(self.filename, "rb") as fp:
+                    self.manifest, self.ledger, self.tables = pickle.load(fp)
+            except:
+                # invalid store --> start from scratch
+                pass
+
+    @staticmethod
+    def _empty_ledger():
+        ledger = {h: np.array([], dtype=np.int64) for h in ["p1", "region", "month", "hash", "src"]}
+        ledger.update({h: np.array([], dtype=np.int64) for h in SLIM[2:]})
+        return ledger
+
+    def save(self):
+        """
+        Stores aggregates to store file
+        """
+        if self.filename:
+            with stage("aggregates.save"):
+                with gzip.open(self.filename, "wb") as fp:
+                    pickle.dump((self.manifest, self.ledger, self.tables), fp)
+
+    def _stat(self, archive):
+        st = os.stat(os.path.join(self.folder, archive))
+        return st.st_size, st.st_mtime_ns
+
+    @staticmethod
+    def _slim(columns, region):
+        """
+        Returns ledger entries of typed columns of one region
+        """
+        n = len(columns["p1"])
+        slim = {h: np.asarray(columns[h], dtype=np.int64) for h in SLIM if h != "p2a"}
+        slim["region"] = np.full(n, Aggregates.regions.index(region), dtype=np.int64)
+        slim["month"] = np.asarray(columns["p2a"]).astype("datetime64[M]").astype(np.int64)
+        return slim
+
+    @staticmethod
+    def _contributions(slim):
+        """
+        Returns keys & values added to each aggregate by ledger entries
+
+        Returns
+        -------
+        dict
+            {aggregate name: (np.array of keys [n, k], np.array of values [n, v])}
+        """
+        ones = np.ones((len(slim["p1"]), 1), dtype=np.int64)
+        injured = (slim["p13a"] > 0) | (slim["p13b"] > 0) | (slim["p13c"] > 0)
+        return {
+            "conditions": (np.column_stack((slim["region"], slim["month"], slim["p18"])), ones),
+            "types": (np.column_stack((slim["region"], slim["p24"])), ones),
+            "vehicles": (np.column_stack((slim["region"], slim["p44"])),
+                         np.column_stack((ones[:, 0], slim["p13a"], slim["p13b"], slim["p13c"], injured))),
+        }
+
+    def _apply(self, slim, sign):
+        """
+        Adds (sign = 1) or subtracts (sign = -1) contributions of ledger entries to aggregates
+        """
+        if not len(slim["p1"]):
+            return
+        for name, (keys, values) in self._contributions(slim).items():
+            table = self.tables[name]
+            uniq, inverse = np.unique(keys, axis=0, return_inverse=True)
+            sums = np.zeros((len(uniq), values.shape[1]), dtype=np.int64)
+            np.add.at(sums, inverse.ravel(), values)
+            for key, vals in zip(map(tuple, uniq.tolist()), (sign * sums).tolist()):
+                vals = [a + b for a, b in zip(table.get(key, [0] * len(vals)), vals)]
+                if any(vals):
+                    table[key] = tuple(vals)
+                else:
+                    table.pop(key, None)
+
+    def _drop(self, gone):
+        """
+        Subtracts contributions of ledger entries & removes them from ledger
+
+        Parameters
+        ----------
+        gone: np.array
+            boolean mask of ledger entries to drop
+        """
+        self._apply({h: v[gone] for h, v in self.ledger.items()}, -1)
+        self.ledger = {h: v[~gone] for h, v in self.ledger.items()}
+
+    def _forget_older(self, key):
+        """
+        Removes archives older than archive key from manifest, so they are read
+        again -- they may hold other versions of entries dropped from a newer one
+
+        Returns
+        -------
+        list
+            forgotten archives
+        """
+        older = [a for a in self.manifest if _archive_key(a) < key]
+        for archive in older:
+            del self.manifest[archive]
+        return older
+
+    def refresh(self):
+        """
+        Updates aggregates with new or changed data archives; stores the result.
+
+        Returns
+        -------
+        dict
+            {"archives": n of processed archives, "parsed": n of parsed entries,
+             "changed": n of entries with changed content, "removed": n of removed archives,
+             "withdrawn": n of entries withdrawn from changed archives}
+        """
+        dd = DataDownloader(folder=self.folder)
+        report = {"archives": 0, "parsed": 0, "changed": 0, "removed": 0, "withdrawn": 0}
+        archives = dd.archives()
+
+        # archives removed from folder --> drop entries they own; older archives
+        # may hold other versions of these entries, so they are read again
+        for archive in [a for a in self.manifest if a not in archives]:
+            key = _archive_key(archive)
+            with stage("aggregates.remove", archive=archive) as st:
+                gone = self.ledger["src"] == key
+                st.rows = int(gone.sum())
+                self._drop(gone)
+            del self.manifest[archive]
+            self._forget_older(key)
+            report["removed"] += 1
+
+        # oldest first -- newer archives override entries of older ones
+        queue = list(reversed(archives))
+        while queue:
+            archive = queue.pop(0)
+            stat = self._stat(archive)
+            if tuple(self.manifest.get(archive, ())) == stat:
+                continue
+            key = _archive_key(archive)
+
+            with stage("aggregates.refresh", archive=archive) as st:
+                parts = []
+                old = []
+                present = [np.array([], dtype=np.int64)]
+                for region in self.regions:
+                    lines = [line for line in dd._read_archive(archive, region).splitlines() if line]
+                    if not lines:
+                        continue
+                    ids = DataDownloader._scan_ids("\n".join(lines))
+                    present.append(ids)
+                    hashes = np.array([zlib.crc32(line.encode()) for line in lines], dtype=np.int64)
+
+                    # delta: unknown IDs & changed content not overridden by newer archive
+                    pos = np.searchsorted(self.ledger["p1"], ids)
+                    found = pos < len(self.ledger["p1"])
+                    found[found] = self.ledger["p1"][pos[found]] == ids[found]
+                    delta = ~found
+                    delta[found] = (self.ledger["hash"][pos[found]] != hashes[found]) & \
+                        (self.ledger["src"][pos[found]] <= key)
+                    # each ID once
+                    first = np.zeros(len(ids), dtype=bool)
+                    first[np.unique(ids, return_index=True)[1]] = True
+                    delta &= first | (ids < 0)
+                    # unchanged copy in newer archive --> entry is now owned by it,
+                    # so re-published older archive can't override it
+                    same = np.flatnonzero(found & ~delta)
+                    self.ledger["src"][pos[same]] = np.maximum(self.ledger["src"][pos[same]], key)
+                    if not delta.any():
+                        continue
+
+                    rows = DataDownloader._parse_text("\n".join(lines[i] for i in np.flatnonzero(delta)))
+                    slim = self._slim(DataDownloader.to_columns(rows, SLIM), region)
+                    slim["hash"] = hashes[delta]
+                    slim["src"] = np.full(len(rows), key, dtype=np.int64)
+                    parts.append(slim)
+                    old.append(pos[delta & found])
+
+                if parts:
+                    new = {h: np.concatenate([p[h] for p in parts]) for h in parts[0]}
+                    old = np.concatenate(old)
+                    report["parsed"] += len(new["p1"])
+                    report["changed"] += len(old)
+                    st.rows = len(new["p1"])
+
+                    # replace contributions of changed entries
+                    self._apply({h: v[old] for h, v in self.ledger.items()}, -1)
+                    self._apply(new, 1)
+
+                    # merge into ledger, keep it sorted by ID
+                    keep = np.ones(len(self.ledger["p1"]), dtype=bool)
+                    keep[old] = False
+                    merged = {h: np.concatenate((self.ledger[h][keep], new[h])) for h in self.ledger}
+                    order = np.argsort(merged["p1"], kind="stable")
+                    self.ledger = {h: v[order] for h, v in merged.items()}
+
+                # entries owned by archive it no longer contains --> drop them,
+                # older archives are read again (after this one) for their other versions
+                gone = (self.ledger["src"] == key) & ~np.isin(self.ledger["p1"], np.concatenate(present))
+                if gone.any():
+                    report["withdrawn"] += int(gone.sum())
+                    self._drop(gone)
+                    older = self._forget_older(key)
+                    queue += [a for a in reversed(archives) if a in older]
+
+            self.manifest[archive] = stat
+            report["archives"] += 1
+
+        self.save()
+        return report
+
+    def verify(self):
+        """
+        Compares aggregates with full recompute from all data archives
+
+        Returns
+        -------
+        list
+            list of (aggregate name, key, stored values, recomputed values) of mismatches
+        """
+        full = Aggregates(self.folder, filename=None)
+        dd = DataDownloader(folder=self.folder)
+        with stage("aggregates.verify"):
+            for region in self.regions:
+                full._apply(self._slim(dd.parse_region_data(region), region), 1)
+
+        mismatches = []
+        for name, table in full.tables.items():
+            for key in set(table) | set(self.tables[name]):
+                if table.get(key) != self.tables[name].get(key):
+                    mismatches.append((name, key, self.tables[name].get(key), table.get(key)))
+        return mismatches
+
+    def conditions(self, regions, values):
+        """
+        Returns monthly counts of accidents per region & road conditions (p18)
+
+        Parameters
+        ----------
+        regions: list
+            region codes
+        values: list
+            codes of road conditions
+
+        Returns
+        -------
+        tuple
+            (np.array of months since 1970-01 [M], np.array of counts [regions, M, values])
+            -- same as layout.monthly_counts
+        """
+        reg_idx = {self.regions.index(r): i for i, r in enumerate(regions)}
+        val_idx = {v: i for i, v in enumerate(values)}
+        entries = [(reg_idx[r], m, val_idx[v], c[0]) for (r, m, v), c in self.tables["conditions"].items()
+                   if r in reg_idx and v in val_idx]
+        if not entries:
+            return np.array([], dtype=np.int64), np.zeros((len(regions), 0, len(values)), dtype=np.int64)
+        r, m, v, c = (np.array(x, dtype=np.int64) for x in zip(*entries))
+        first = m.min()
+        counts = np.zeros((len(regions), m.max() - first + 1, len(values)), dtype=np.int64)
+        counts[r, m - first, v] = c
+        return np.arange(first, m.max() + 1), counts
+
+    def accident_types(self, n_types=6):
+        """
+        Returns counts of accident types (p24) per region, as get_stat.get_data
+
+        Parameters
+        ----------
+        n_types: int
+            number of accident types
+
+        Returns
+        -------
+        tuple
+            (list of counts of each type per region, list of regions)
+        """
+        present = sorted({r for r, _ in self.tables["types"]})
+        out = [[0] * n_types for _ in present]
+        for (r, t), c in self.tables["types"].items():
+            if 0 <= t < n_types:
+                out[present.index(r)][t] = c[0]
+        return out, [self.regions[r] for r in present]
+
+    def vehicle_sums(self):
+        """
+        Returns sums of accidents & injuries per vehicle type, as doc.vehicle_sums
+
+        Returns
+        -------
+        pandas.DataFrame
+            data frame indexed by vehicle type
+        """
+        import pandas as pd
+        from doc import VEHICLES, SUM_COLUMNS
+
+        sums = dict()
+        for (_, p44), vals in self.tables["vehicles"].items():
+            if p44 in VEHICLES:
+                acc = sums.setdefault(VEHICLES[p44], [0] * len(vals))
+                sums[VEHICLES[p44]] = [a + b for a, b in zip(acc, vals)]
+        return pd.DataFrame.from_dict(sums, orient="index", columns=SUM_COLUMNS).rename_axis("Vehicles")
+
+
+if __name__ == "__main__":
+    agg = Aggregates(folder="../data/")
+    print("Refreshed:", agg.refresh())
+    mismatches = agg.verify()
+    print("Consistent with full recompute" if not mismatches else
+          "{} mismatches, e.g. {}".format(len(mismatches), mismatches[:5]))
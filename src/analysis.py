@@ -7,6 +7,12 @@ import seaborn as sns
 import matplotlib.dates as mdates
 import os
 import sys
+import numpy as np
+import layout
+import preview
+import spill
+import zonemap
+from profiling import stage
 
 
 def _print_size(type, df):
@@ -40,48 +46,186 @@ def _save_fig(fig_location):
         dir = os.path.dirname(fig_location)
         if dir and not os.path.exists(dir):
             os.makedirs(dir)
-        plt.savefig(fig_location)
+        with stage("figure.save", file=fig_location):
+            plt.savefig(fig_location)
     except:
         print("ERROR: Failed to save figure", fig_location, file=sys.stderr)
         sys.exit(1)
 
 
-def get_dataframe(filename: str, verbose: bool = False) -> pd.DataFrame:
+def get_dataframe(filename: str, verbose: bool = False, columns: list = None,
+                  regions: list = None, years: list = None, where: list = None,
+                  sample: float = None) -> pd.DataFrame:
     """
-    Fetches data on accidents in CZ from local file
+    Fetches data on accidents in CZ from local file.
+    Rows are sorted by (region, date) & indexed by layout module;
+    index & order of rows are stored next to the data file (see layout.load).
 
     Parameters
     ----------
     filename: str
-        name of data file
+        name of data file -- pickled DataFrame,
+        or root directory of partitioned Parquet dataset
 
     verbose: bool
         prints info on memory usage reduction
 
+    columns: list
+        attributes to read from Parquet dataset; all if missing
+
+    regions: list
+        regions to read from Parquet dataset; all if missing
+
+    years: list
+        years to read from Parquet dataset; all if missing
+
+    where: list
+        predicate on rows to keep (see zonemap module); all if missing.
+        Parquet dataset skips partitions which cannot match it, pickle is filtered after reading
+
+    sample: float
+        preview mode -- fraction of stratified sample (see preview module)
+        to use instead of whole data; whole data if missing
+
     Returns
     -------
     pandas.DataFrame
         data frame containing parsed data
     """
 
-    # fetch data file
-    df = pd.read_pickle(filename)
-    if verbose:
-        _print_size("orig", df)
-
-    # create categories
-    exclude = ["p1", "d", "e", "region", "p21", "p2a"]
-    reduce_list = list(set(df.columns) - set(exclude))
-    for col in reduce_list:
-        df[col] = df[col].astype("category")
-    # create date
-    df["date"] = pd.to_datetime(df["p2a"])
+    def read():
+        if os.path.isdir(filename):
+            from dataset import read_dataframe
+            return read_dataframe(filename, columns, regions, years, where=where)
+        df = pd.read_pickle(filename)
+        if where:
+            # same rows as from dataset
+            df = df.loc[zonemap.matches(df, where)].reset_index(drop=True)
+        return df
+
+    def load():
+        # fetch data file
+        with stage("analysis.load", file=filename) as st:
+            if not sample:
+                df = read()
+            elif columns or regions or years or where:
+                # stored sample is of whole data only
+                df = preview.sample(read(), sample)
+            else:
+                df = preview.load(filename, sample, read)
+            st.rows = len(df)
+        if verbose:
+            _print_size("orig", df)
+
+        with stage("analysis.construct", rows=len(df)):
+            # create categories
+            exclude = ["p1", "d", "e", "region", "p21", "p2a"]
+            reduce_list = list(set(df.columns) - set(exclude))
+            for col in reduce_list:
+                df[col] = df[col].astype("category")
+            # create date
+            if "p2a" in df:
+                df["date"] = pd.to_datetime(df["p2a"])
+        return df
+
+    # sort by region & date, attach offsets index; layout & order of rows
+    # of whole data are stored next to the data file
+    if sample or where or (os.path.isdir(filename) and (columns or regions or years)):
+        index_file = None
+    elif os.path.isdir(filename):
+        index_file = os.path.join(filename, "_layout.pkl")
+    else:
+        index_file = filename + ".layout.pkl"
+    if index_file:
+        df = layout.load(index_file, filename, load)
+    else:
+        df = load()
+        if "region" in df and "date" in df:
+            df = layout.ensure(df)
 
     if verbose:
         _print_size("new", df)
     return df
 
 
+def _budgeted_monthly_counts(df, regs: list, column: str, values: list):
+    """
+    Counts rows of each region per month & value of column in partitions
+    within memory budget (see spill module). Same result as layout.monthly_counts.
+    """
+    with stage("analysis.budgeted_counts", rows=len(df)) as st:
+        regs, values = np.asarray(regs, dtype=str), np.asarray(values, dtype=np.int64)
+        sums = spill.GroupSum(3, 1)
+        with spill.tracked() as mem:
+            # region, date, column & key of each row
+            for a, b in spill.partitions(len(df), row_bytes=16 * 8):
+                reg = df["region"].iloc[a:b].to_numpy().astype(str)
+                col = np.asarray(df[column].iloc[a:b].to_numpy(), dtype=np.int64)
+                r = np.searchsorted(regs, reg).clip(0, len(regs) - 1)
+                keep = (regs[r] == reg) & np.isin(col, values)
+                month = df["date"].iloc[a:b].to_numpy()[keep].astype("datetime64[M]").astype(np.int64)
+                sums.add(np.column_stack((r[keep], month, col[keep])), np.ones(len(month)))
+            keys, counts = sums.result()
+        st.meta.update(peak=mem["peak"], held=sums.held_peak, spilled=sums.spilled)
+
+    if not len(keys):
+        return np.array([], dtype=np.int64), np.zeros((len(regs), 0, len(values)), dtype=np.int64)
+    first, last = keys[:, 1].min(), keys[:, 1].max()
+    result = np.zeros((len(regs), last - first + 1, len(values)), dtype=np.int64)
+    v = np.searchsorted(np.sort(values), keys[:, 2])
+    result[keys[:, 0], keys[:, 1] - first, np.argsort(values)[v]] = counts[:, 0]
+    return np.arange(first, last + 1), result
+
+
+def _monthly_conditions(df, regs: list, conds: dict) -> pd.DataFrame:
+    """
+    Counts accidents per region, month & road conditions using month blocks
+    of data layout, or in partitions within memory budget (see spill module),
+    or takes them from materialised aggregates.
+    Result matches the pivot -> resample -> melt chain.
+
+    Parameters
+    ----------
+    df: pandas.DataFrame
+        data frame with layout (or any with memory budget set), or aggregates.Aggregates store
+
+    regs: list
+        sorted region codes
+
+    conds: dict
+        road conditions: {code: label}
+
+    Returns
+    -------
+    pandas.DataFrame
+        long data frame with columns region, date (month end), p18, value
+    """
+
+    if hasattr(df, "conditions"):
+        months, counts = df.conditions(regs, list(conds))
+    elif spill.budget is not None:
+        months, counts = _budgeted_monthly_counts(df, regs, "p18", list(conds))
+    else:
+        months, counts = layout.monthly_counts(df, regs, "p18", list(conds))
+    # skip conditions with no accidents & months before first / after last accident
+    labels = sorted((label, i) for i, label in enumerate(conds.values()) if counts[:, :, i].any())
+    counts = counts[:, :, [i for _, i in labels]]
+    active = np.flatnonzero(counts.any(axis=(0, 2)))
+    if len(active):
+        months, counts = months[active[0]:active[-1]+1], counts[:, active[0]:active[-1]+1]
+    # month end dates, as labelled by resample(MonthEnd)
+    dates = pd.to_datetime((months + 1).astype("datetime64[M]").astype("datetime64[D]") -
+                           np.timedelta64(1, "D"))
+
+    n_reg, n_months, n_labels = counts.shape
+    return pd.DataFrame({
+        "region": np.tile(regs, n_labels * n_months),
+        "date": np.tile(np.repeat(dates, n_reg), n_labels),
+        "p18": np.repeat([label for label, _ in labels], n_months * n_reg),
+        "value": counts.transpose(2, 1, 0).ravel(),
+    })
+
+
 def plot_roadtype(df: pd.DataFrame, fig_location: str = None,
                   show_figure: bool = False):
     """
@@ -100,22 +244,30 @@ def plot_roadtype(df: pd.DataFrame, fig_location: str = None,
     """
 
     # fetch data
-    regs = ["VYS", "PAK", "LBK", "KVK"]
-    df["p21"] = pd.cut(df["p21"], [-1, 0, 1, 2, 4, 5, 6])
-    data = df.loc[df["region"].isin(regs), ["p21", "region"]]
+    with stage("analysis.plot_roadtype.aggregate", rows=len(df)):
+        regs = ["VYS", "PAK", "LBK", "KVK"]
+        df["p21"] = pd.cut(df["p21"], [-1, 0, 1, 2, 4, 5, 6])
+        data = df.loc[df["region"].isin(regs), ["p21", "region"]]
 
     # plotting
-    sns.set_theme()
-    g = sns.catplot(data=data, x="region", kind="count",
-                    col="p21", col_wrap=3, palette="flare", height=3)
-    g.set_axis_labels("Region", "Accidents")
-    titles = ["Two-lane road", "Three-lane road", "Four-lane road",
-              "Multi-lane road", "Expressway", "Other road"]
-    for i in range(6):
-        g.axes[i].set_title(titles[i])
-        g.axes[i].set_yscale("log")
-    plt.suptitle("Accidents per road type")
-    plt.subplots_adjust(top=0.88)
+    with stage("analysis.plot_roadtype.render", rows=len(data)):
+        sns.set_theme()
+        g = sns.catplot(data=data, x="region", kind="count",
+                        col="p21", col_wrap=3, palette="flare", height=3)
+        g.set_axis_labels("Region", "Accidents")
+        titles = ["Two-lane road", "Three-lane road", "Four-lane road",
+                  "Multi-lane road", "Expressway", "Other road"]
+        for i in range(6):
+            g.axes[i].set_title(titles[i])
+            g.axes[i].set_yscale("log")
+        plt.suptitle("Accidents per road type")
+        plt.subplots_adjust(top=0.88)
+
+        frac = preview.fraction(df)
+        if frac:
+            for ax in g.axes:
+                preview.scale_axis(ax, 1 / frac)
+            preview.annotate(g.figure, "roadtype", data.groupby(["region", "p21"], observed=True).size(), frac)
 
     # showing / storing figure
     if fig_location:
@@ -142,31 +294,38 @@ def plot_animals(df: pd.DataFrame, fig_location: str = None,
     """
 
     # fetch data -- filter by year, cause, region
-    regs = ["STC", "ULK", "JHM", "VYS"]
-    data = df.loc[(df["date"].dt.year < 2021) &
-                  (df["p58"] == 5) &
-                  (df["region"].isin(regs)), ["region", "p10", "date"]]
-    # replace categories
-    data["p10"] = data["p10"].map(
-        dict.fromkeys((1, 2), "driver") |
-        {4: "animal"} |
-        dict.fromkeys((-1, 0, 3, 5, 6, 7), "other"))
-    # get month from dates
-    data["date"] = data["date"].dt.month
+    with stage("analysis.plot_animals.aggregate", rows=len(df)):
+        regs = ["STC", "ULK", "JHM", "VYS"]
+        data = layout.select(df, regs, end="2021-01-01")
+        data = data.loc[data["p58"] == 5, ["region", "p10", "date"]]
+        # replace categories
+        data["p10"] = data["p10"].map(
+            dict.fromkeys((1, 2), "driver") |
+            {4: "animal"} |
+            dict.fromkeys((-1, 0, 3, 5, 6, 7), "other"))
+        # get month from dates
+        data["date"] = data["date"].dt.month
 
     # plotting
-    sns.set_theme()
-    g = sns.catplot(data=data, x="date", hue="p10", col="region", kind="count",
-                    hue_order=["animal", "driver", "other"], palette="rocket_r",
-                    col_wrap=2, height=3.5, aspect=1.5, sharex=False, legend=False)
-    g.set_ylabels("Accidents")
-    g.set_titles("Region: {col_name}")
-    g.add_legend(title="At fault")
-    plt.subplots_adjust(hspace=.35)
-    for x in g.axes:
-        x.set_xlabel("Month")
-    plt.suptitle("Accidents involving animals")
-    plt.subplots_adjust(top=0.88)
+    with stage("analysis.plot_animals.render", rows=len(data)):
+        sns.set_theme()
+        g = sns.catplot(data=data, x="date", hue="p10", col="region", kind="count",
+                        hue_order=["animal", "driver", "other"], palette="rocket_r",
+                        col_wrap=2, height=3.5, aspect=1.5, sharex=False, legend=False)
+        g.set_ylabels("Accidents")
+        g.set_titles("Region: {col_name}")
+        g.add_legend(title="At fault")
+        plt.subplots_adjust(hspace=.35)
+        for x in g.axes:
+            x.set_xlabel("Month")
+        plt.suptitle("Accidents involving animals")
+        plt.subplots_adjust(top=0.88)
+
+        frac = preview.fraction(df)
+        if frac:
+            for ax in g.axes:
+                preview.scale_axis(ax, 1 / frac)
+            preview.annotate(g.figure, "animals", data.groupby(["region", "date", "p10"]).size(), frac)
 
     # showing / storing figure
     if fig_location:
@@ -183,7 +342,7 @@ def plot_conditions(df: pd.DataFrame, fig_location: str = None,
     Parameters
     ----------
     df: pandas.DataFrame
-        data frame
+        data frame, or aggregates.Aggregates store
 
     fig_location: str
         path for figure storing
@@ -193,42 +352,57 @@ def plot_conditions(df: pd.DataFrame, fig_location: str = None,
     """
 
     # fetch data -- filter by wind conds & region
-    regs = ["STC", "ULK", "JHM", "VYS"]
-    data = df.loc[(df["p18"] != 0) & (df["region"].isin(regs)),
-                  ["region", "date", "p18"]]
-    # replace values
-    data["p18"] = data["p18"].map({
-        1: "unobstructed",
-        2: "fog",
-        3: "weak rain",
-        4: "rain",
-        5: "snow",
-        6: "frosty road",
-        7: "wind gust",
-    })
-
-    data = pd.pivot_table(
-        data, index=["region", "date"], columns="p18", aggfunc="size")
-    data = data.unstack("region").resample(
-        "M").sum().astype("int").stack("region").reset_index()
-    data = pd.melt(data, id_vars=["region", "date"])
+    with stage("analysis.plot_conditions.aggregate"):
+        regs = ["STC", "ULK", "JHM", "VYS"]
+        conds = {
+            1: "unobstructed",
+            2: "fog",
+            3: "weak rain",
+            4: "rain",
+            5: "snow",
+            6: "frosty road",
+            7: "wind gust",
+        }
+        if hasattr(df, "conditions") or spill.budget is not None or layout.get(df) is not None:
+            data = _monthly_conditions(df, sorted(regs), conds)
+        else:
+            data = df.loc[(df["p18"] != 0) & (df["region"].isin(regs)),
+                          ["region", "date", "p18"]]
+            # replace values
+            data["p18"] = data["p18"].map(conds)
+
+            data = pd.pivot_table(
+                data, index=["region", "date"], columns="p18", aggfunc="size")
+            # MonthEnd -- alias "M" is removed in newer pandas
+            data = data.unstack("region").resample(
+                pd.offsets.MonthEnd()).sum().astype("int").stack("region").reset_index()
+            data = pd.melt(data, id_vars=["region", "date"])
+
+        # preview -- counts of sample scaled to whole data
+        frac = preview.fraction(df)
+        if frac:
+            counts = data["value"].to_numpy()
+            data["value"] = counts / frac
 
     # plotting
-    sns.set_theme()
-    g = sns.FacetGrid(data, col="region", height=3.5,
-                      aspect=1.5, col_wrap=2, sharex=False)
-    g.map(sns.lineplot, "date", "value", "p18")
-    plt.subplots_adjust(wspace=0.15)
-    g.set_ylabels("Accidents")
-    g.set_xlabels("")
-    g.set_titles("Region: {col_name}")
-    g.add_legend(title="Conditions", borderpad=1.5)
-    g.set(xlim=(date(2016, 1, 1), date(2021, 1, 1)))
-    xformatter = mdates.DateFormatter("%m/%y")
-    for ax in g.axes:
-        ax.xaxis.set_major_formatter(xformatter)
-    plt.suptitle("Accidents per road conditions")
-    plt.subplots_adjust(top=0.88)
+    with stage("analysis.plot_conditions.render", rows=len(data)):
+        sns.set_theme()
+        g = sns.FacetGrid(data, col="region", height=3.5,
+                          aspect=1.5, col_wrap=2, sharex=False)
+        g.map(sns.lineplot, "date", "value", "p18")
+        plt.subplots_adjust(wspace=0.15)
+        g.set_ylabels("Accidents")
+        g.set_xlabels("")
+        g.set_titles("Region: {col_name}")
+        g.add_legend(title="Conditions", borderpad=1.5)
+        g.set(xlim=(date(2016, 1, 1), date(2021, 1, 1)))
+        xformatter = mdates.DateFormatter("%m/%y")
+        for ax in g.axes:
+            ax.xaxis.set_major_formatter(xformatter)
+        plt.suptitle("Accidents per road conditions")
+        plt.subplots_adjust(top=0.88)
+        if frac:
+            preview.annotate(g.figure, "conditions", counts, frac)
 
     # showing / storing figure
     if fig_location:
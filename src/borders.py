@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# File: borders.py
+# Brief: Validation of accident coordinates against region boundaries
+#
+# Project: Data analysis & visualization of traffic accidents
+#
+# Authors: Jakub Bartko    xbartk07@stud.fit.vutbr.cz
+#
+# Boundaries are read from a local file readable by geopandas (GeoJSON,
+# Shapefile, GeoPackage, ...) with one polygon per region and a column of
+# region codes as used by DataDownloader (PHA, STC, ...). Points are
+# assigned to polygons in bulk instead of per-row `within` calls:
+#   1. a grid over the boundaries marks cells lying inside one polygon or
+#      outside all of them; points of such cells are assigned by lookup
+#   2. points of cells crossed by a border are tested exactly by spatial
+#      index query (R-tree of polygon bounding boxes & prepared polygons)
+
+
+import numpy as np
+import pandas as pd
+from download import DataDownloader
+from frames import valid_coords
+from profiling import stage
+
+
+# default location of boundary file
+BOUNDARIES = "../data/regions.geojson"
+
+# status of entries, see validate
+STATUS = ["ok", "mismatch", "outside", "missing"]
+
+# number of grid cells along each axis
+GRID_SIZE = 128
+
+
+def load(filename: str = BOUNDARIES, column: str = "region"):
+    """
+    Loads region boundaries
+
+    Parameters
+    ----------
+    filename: str
+        path of boundary file
+    column: str
+        column of boundary file with region codes; if there is no such column,
+        the first column holding only region codes is used
+
+    Returns
+    -------
+    geopandas.GeoDataFrame
+        boundaries with "region" column, in EPSG:5514
+    """
+    import geopandas
+
+    with stage("borders.load", file=filename):
+        gdf = geopandas.read_file(filename)
+        if gdf.crs is None:
+            raise ValueError("boundary file has no CRS: " + filename)
+        if column not in gdf:
+            codes = set(DataDownloader.regions)
+            found = [c for c in gdf.columns if c != "geometry" and set(gdf[c].astype(str)) <= codes]
+            if not found:
+                raise ValueError("boundary file has no column of region codes: " + filename)
+            column = found[0]
+        gdf = gdf.rename(columns={column: "region"})[["region", "geometry"]]
+        return gdf.to_crs("EPSG:5514")
+
+
+def _grid(boundaries, size):
+    """
+    Returns grid over boundaries: (bounds, np.array [size * size] of cell
+    polygon index; -1 for cells outside all polygons, -2 for cells crossed by border)
+    """
+    import shapely
+
+    with stage("borders.grid", cells=size * size):
+        minx, miny, maxx, maxy = boundaries.total_bounds
+        i, j = np.divmod(np.arange(size * size), size)
+        w, h = (maxx - minx) / size, (maxy - miny) / size
+        cells = shapely.box(minx + j * w, miny + i * h, minx + (j + 1) * w, miny + (i + 1) * h)
+
+        grid = np.full(size * size, -1, dtype=np.int64)
+        touching = np.unique(boundaries.sindex.query(cells, predicate="intersects")[0])
+        grid[touching] = -2
+        cell_idx, poly_idx = boundaries.sindex.query(cells[touching], predicate="within")
+        grid[touching[cell_idx]] = poly_idx
+    return (minx, miny, maxx, maxy), grid
+
+
+def assign(x, y, boundaries, grid_size: int = GRID_SIZE) -> np.array:
+    """
+    Returns region code of polygon containing each point
+
+    Parameters
+    ----------
+    x: np.array
+        x coordinates (EPSG:5514)
+    y: np.array
+        y coordinates (EPSG:5514)
+    boundaries: geopandas.GeoDataFrame
+        region boundaries, see load
+    grid_size: int
+        number of grid cells along each axis; no grid if 0
+
+    Returns
+    -------
+    np.array
+        region codes; None for missing coordinates & points outside all regions
+    """
+    import geopandas
+
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    codes = np.append(boundaries["region"].to_numpy().astype(object), None)
+    # polygon index of each point; -1 outside, -2 not decided yet
+    found = np.full(len(x), -1, dtype=np.int64)
+    valid = valid_coords(x, y)
+    found[valid] = -2
+
+    if grid_size:
+        (minx, miny, maxx, maxy), grid = _grid(boundaries, grid_size)
+        with stage("borders.lookup", rows=len(x)):
+            inside = valid & (x >= minx) & (x <= maxx) & (y >= miny) & (y <= maxy)
+            # points off grid are outside all regions
+            found[valid & ~inside] = -1
+            col = np.minimum(((x[inside] - minx) / (maxx - minx) * grid_size).astype(np.int64), grid_size - 1)
+            row = np.minimum(((y[inside] - miny) / (maxy - miny) * grid_size).astype(np.int64), grid_size - 1)
+            found[inside] = grid[row * grid_size + col]
+
+    with stage("borders.assign", rows=len(x)) as st:
+        exact = np.flatnonzero(found == -2)
+        st.meta["exact"] = len(exact)
+        points = geopandas.points_from_xy(x[exact], y[exact])
+        found[exact] = -1
+        # pairs (point, polygon) of points within polygons
+        point_idx, poly_idx = boundaries.sindex.query(points, predicate="within")
+        # point on shared border -> first polygon
+        first = np.unique(point_idx, return_index=True)[1]
+        found[exact[point_idx[first]]] = poly_idx[first]
+    return codes[found]
+
+
+def validate(df: pd.DataFrame, boundaries, correct: bool = False) -> pd.DataFrame:
+    """
+    Checks that coordinates of entries ("d", "e") lie in their region.
+    Adds columns:
+        geo_region -- region containing the point; None if outside or missing
+        geo_status -- "ok", "mismatch" (point in other region),
+                      "outside" (point out of all regions), "missing" (no coordinates)
+
+    Parameters
+    ----------
+    df: pandas.DataFrame
+        data with "region", "d" & "e" columns
+    boundaries: geopandas.GeoDataFrame or str
+        region boundaries (see load), or path of boundary file
+    correct: bool
+        relabel mismatched entries with region containing their point &
+        drop coordinates (set to -1) of entries outside all regions
+
+    Returns
+    -------
+    pandas.DataFrame
+        the data frame with added columns
+    """
+    if isinstance(boundaries, str):
+        boundaries = load(boundaries)
+
+    x, y = df["d"].to_numpy(dtype=float), df["e"].to_numpy(dtype=float)
+    found = assign(x, y, boundaries)
+
+    with stage("borders.validate", rows=len(df)) as st:
+        labels = df["region"].to_numpy().astype(str)
+        missing = ~valid_coords(x, y)
+        outside = ~missing & pd.isna(found)
+        mismatch = ~missing & ~outside & (found != labels)
+
+        status = np.zeros(len(df), dtype=np.int8)
+        status[mismatch] = STATUS.index("mismatch")
+        status[outside] = STATUS.index("outside")
+        status[missing] = STATUS.index("missing")
+        df["geo_region"] = found
+        df["geo_status"] = pd.Categorical.from_codes(status, STATUS)
+        st.meta.update(mismatch=int(mismatch.sum()), outside=int(outside.sum()))
+
+        if correct:
+            if mismatch.any():
+                labels = labels.astype(object)
+                labels[mismatch] = found[mismatch]
+                df["region"] = labels
+            if outside.any():
+                for col in ["d", "e"]:
+                    values = df[col].to_numpy(dtype=float, copy=True)
+                    values[outside] = -1
+                    df[col] = values
+    return df
+
+
+def report(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Returns numbers of entries of each status (see validate) per region
+
+    Parameters
+    ----------
+    df: pandas.DataFrame
+        validated data
+
+    Returns
+    -------
+    pandas.DataFrame
+        data frame indexed by region, one column per status
+    """
+    return pd.crosstab(df["region"].astype(str), df["geo_status"]).reindex(columns=STATUS, fill_value=0)
+
+
+if __name__ == "__main__":
+    df = validate(pd.read_pickle("../data/accidents.pkl.gz"), BOUNDARIES)
+    print(report(df))
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# File: colcache.py
+# Brief: Column-chunk cache files of parsed data
+#
+# Project: Data analysis & visualization of traffic accidents
+#
+# Authors: Jakub Bartko    xbartk07@stud.fit.vutbr.cz
+#
+# Each column is split into chunks of CHUNK_ROWS rows, each chunk is
+# compressed on its own; an index (JSON) of chunk offsets is stored at the
+# end of the file:
+#   <chunks...> <index> <index offset: uint64> MAGIC
+# Chunks are decompressed in parallel by a thread pool into slices of
+# preallocated column arrays (codecs release the GIL); only requested
+# columns are read. zstd writes straight into the slice, lz4 & zlib return
+# new bytes which are copied into it.
+#
+# Codecs: zstd (zstandard package) or lz4 (lz4 package) if installed,
+# zlib otherwise. Codec "none" is the uncompressed tier: each column is
+# one aligned chunk, numeric & date columns are mapped to memory as they
+# are -- nothing is read until used.
+# String (object) columns are dictionary encoded: uint32 code of each row &
+# NUL separated UTF-8 distinct values.
+
+
+import json
+import mmap
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from profiling import stage
+
+
+MAGIC = b"IZVCOLS1"
+
+# rows per chunk
+CHUNK_ROWS = 64 * 1024
+
+# alignment of uncompressed chunks [B]
+ALIGN = 64
+
+# number of threads of (de)compression; None -- number of CPUs
+threads = None
+
+
+def _zstd():
+    import zstandard
+
+    def decompress(data, size, out=None):
+        if out is None:
+            return zstandard.ZstdDecompressor().decompress(data, max_output_size=size)
+        with zstandard.ZstdDecompressor().stream_reader(data) as reader:
+            pos = 0
+            while pos < size:
+                n = reader.readinto(out[pos:])
+                if not n:
+                    break
+                pos += n
+        return out
+
+    return lambda data: zstandard.ZstdCompressor(level=3).compress(data), decompress
+
+
+def _lz4():
+    import lz4.frame
+    return lz4.frame.compress, lambda data, size, out=None: lz4.frame.decompress(data)
+
+
+# codec: function returning (compress(bytes), decompress(bytes, size, out=None));
+# decompress may write into writable buffer out of size bytes & return it,
+# otherwise it returns new bytes
+CODECS = {
+    "zstd": _zstd,
+    "lz4": _lz4,
+    "zlib": lambda: (lambda data: zlib.compress(data, 1), lambda data, size, out=None: zlib.decompress(data)),
+    "none": lambda: (bytes, lambda data, size, out=None: data),
+}
+
+
+def default_codec():
+    """
+    Returns best installed codec: zstd, lz4 or zlib
+    """
+    for name in ["zstd", "lz4"]:
+        try:
+            CODECS[name]()
+            return name
+        except ImportError:
+            pass
+    return "zlib"
+
+
+def _encode(values):
+    """
+    Returns raw bytes of column values
+    """
+    if values.dtype == object:
+        # dictionary encoding: codes of rows (uint32) & distinct values
+        uniques, codes = np.unique(values.astype(str), return_inverse=True)
+        return codes.astype(np.uint32).tobytes() + "\0".join(uniques).encode("utf-8")
+    return np.ascontiguousarray(values).tobytes()
+
+
+def _pool(n):
+    return ThreadPoolExecutor(n or threads or os.cpu_count())
+
+
+def write(filename, data, codec=None, chunk_rows=CHUNK_ROWS, n_threads=None):
+    """
+    Stores data to column-chunk cache file
+
+    Parameters
+    ----------
+    filename: str
+        path of cache file
+    data: dict
+        dictionary of data entries: {header: np.array(entries)}
+    codec: str
+        compression codec: "zstd", "lz4", "zlib" or "none" (uncompressed tier);
+        best installed one if missing
+    chunk_rows: int
+        rows per chunk
+    n_threads: int
+        number of compressing threads; [threads] if missing
+    """
+    codec = codec or default_codec()
+    compress, _ = CODECS[codec]()
+    rows = len(next(iter(data.values()))) if data else 0
+    if codec == "none":
+        # one chunk per column --> columns may be mapped to memory
+        chunk_rows = max(1, rows)
+
+    with stage("colcache.write", rows=rows, codec=codec) as st:
+        tasks = [(name, start, min(rows, start + chunk_rows))
+                 for name in data for start in range(0, max(1, rows), chunk_rows)]
+        with _pool(n_threads) as pool:
+            def pack(task):
+                raw = _encode(data[task[0]][task[1]:task[2]])
+                return len(raw), compress(raw)
+
+            blobs = pool.map(pack, tasks)
+
+            index = {"rows": rows, "codec": codec, "columns": {}}
+            for name in data:
+                values = data[name]
+                index["columns"][name] = {"dtype": values.dtype.str if values.dtype != object else "object",
+                                          "chunks": []}
+            tmp = filename + ".tmp"
+            with open(tmp, "wb") as fp:
+                for (name, start, stop), (size, blob) in zip(tasks, blobs):
+                    # align chunk start
+                    fp.write(b"\0" * (-fp.tell() % ALIGN))
+                    index["columns"][name]["chunks"].append([fp.tell(), len(blob), stop - start, size])
+                    fp.write(blob)
+                offset = fp.tell()
+                fp.write(json.dumps(index).encode())
+                fp.write(np.uint64(offset).tobytes() + MAGIC)
+                st.meta["bytes"] = fp.tell()
+            os.replace(tmp, filename)
+
+
+def read_index(filename):
+    """
+    Returns index of cache file: {"rows", "codec", "columns": {name: {"dtype", "chunks"}}};
+    chunks are [offset, compressed size, rows, raw size]
+    """
+    with open(filename, "rb") as fp:
+        fp.seek(-8 - len(MAGIC), os.SEEK_END)
+        tail = fp.read()
+        if tail[8:] != MAGIC:
+            raise ValueError("not a column-chunk cache file: " + filename)
+        offset = int(np.frombuffer(tail[:8], dtype=np.uint64)[0])
+        fp.seek(offset)
+        return json.loads(fp.read()[:-8 - len(MAGIC)])
+
+
+def read(filename, columns=None, n_threads=None):
+    """
+    Loads data from column-chunk cache file
+
+    Parameters
+    ----------
+    filename: str
+        path of cache file
+    columns: list
+        columns to load; all if missing
+    n_threads: int
+        number of decompressing threads; [threads] if missing
+
+    Returns
+    -------
+    dict
+        dictionary of data entries: {header: np.array(entries)};
+        numeric & date columns of uncompressed file are copy-on-write memory maps
+    """
+    index = read_index(filename)
+    _, decompress = CODECS[index["codec"]]()
+    rows = index["rows"]
+    names = list(index["columns"]) if columns is None else list(columns)
+
+    with stage("colcache.read", rows=rows, codec=index["codec"]) as st:
+        with open(filename, "rb") as fp:
+            # copy-on-write --> arrays are writable, file is never changed
+            buf = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_COPY) if os.path.getsize(filename) else b""
+        view = memoryview(buf)
+
+        data, strings, tasks = dict(), dict(), []
+        for name in names:
+            col = index["columns"][name]
+            if col["dtype"] == "object":
+                data[name] = np.empty(rows, dtype=object)
+                strings[name] = col["chunks"]
+                continue
+            dtype = np.dtype(col["dtype"])
+            if index["codec"] == "none":
+                offset = col["chunks"][0][0] if col["chunks"] else 0
+                data[name] = np.frombuffer(buf, dtype=dtype, count=rows, offset=offset) if rows \
+                    else np.empty(0, dtype=dtype)
+                continue
+            # preallocated column, chunks are decompressed into its slices
+            data[name] = np.empty(rows, dtype=dtype)
+            start = 0
+            for offset, length, n, size in col["chunks"]:
+                tasks.append((data[name], start, n, offset, length, size))
+                start += n
+
+        def fill(task):
+            out, start, n, offset, length, size = task
+            dest = memoryview(out[start:start + n].view(np.uint8))
+            raw = decompress(view[offset:offset + length], size, dest)
+            if raw is not dest:
+                out[start:start + n] = np.frombuffer(raw, dtype=out.dtype, count=n)
+
+        def decode(chunk):
+            offset, length, n, size = chunk
+            raw = decompress(view[offset:offset + length], size)
+            if not n:
+                return np.empty(0, dtype=object)
+            uniques = np.array(bytes(raw[4 * n:]).decode("utf-8").split("\0"), dtype=object)
+            return uniques[np.frombuffer(raw, dtype=np.uint32, count=n)]
+
+        with _pool(n_threads) as pool:
+            for _ in pool.map(fill, tasks):
+                pass
+            for name, chunks in strings.items():
+                start = 0
+                for values in pool.map(decode, chunks):
+                    data[name][start:start + len(values)] = values
+                    start += len(values)
+        st.meta["bytes"] = len(buf)
+    return data
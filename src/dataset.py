@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# File: dataset.py
+# Brief: Partitioned Parquet storage of accident data
+#
+# Project: Data analysis & visualization of traffic accidents
+#
+# Authors: Jakub Bartko    xbartk07@stud.fit.vutbr.cz
+#
+# Layout of the dataset (Hive-style partitioning):
+#   <path>/region=JHM/year=2019/part-0.parquet
+# Each file stores row-group statistics, so readers may skip row groups,
+# and only files of requested regions & years are opened at all.
+# Zone maps of each partition (see zonemap module) are kept in
+#   <path>/_zonemaps.json
+# so partitions which cannot match a predicate (`where`) are not opened either.
+
+
+import json
+import os
+import numpy as np
+import zonemap
+from download import DataDownloader
+from profiling import stage
+
+
+# rows per Parquet row group
+ROW_GROUP_SIZE = 64 * 1024
+
+# zone maps of partitions: {"region=JHM/year=2019": {"rows", "bytes", "files", "columns"}}
+ZONEMAPS = "_zonemaps.json"
+
+
+def _arrow_column(header, values):
+    """
+    Returns attribute values converted to pyarrow array of correct type
+
+    Parameters
+    ----------
+    header: str
+        attribute label
+    values: np.array
+        attribute values as produced by DataDownloader
+    """
+    import pyarrow as pa
+
+    if header == "region":
+        return pa.array(values.astype(str), type=pa.string())
+    kind = DataDownloader.types[DataDownloader.headers.index(header)]
+    if kind == "str":
+        return pa.array(values.astype(str), type=pa.string())
+    if kind == "float":
+        return pa.array(values.astype(np.float64, copy=False))
+    if kind == "int":
+        return pa.array(values.astype(np.int64, copy=False))
+    # dates are stored as Parquet dates
+    return pa.array(values.astype("datetime64[D]"))
+
+
+def write_dataset(data, path, row_group_size=ROW_GROUP_SIZE):
+    """
+    Stores data as Parquet dataset partitioned by region & year.
+    Existing partitions of stored regions & years are replaced.
+
+    Parameters
+    ----------
+    data: dict
+        dictionary of data entries: {header: np.array(entries)}
+    path: str
+        root directory of dataset
+    row_group_size: int
+        max number of rows in Parquet row group
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    with stage("dataset.convert", rows=len(data["region"])):
+        columns = {h: _arrow_column(h, data[h]) for h in data}
+        columns["year"] = pa.array(
+            np.asarray(data["p2a"], dtype="datetime64[Y]").astype(np.int64) + 1970, type=pa.int16())
+        table = pa.table(columns)
+
+    with stage("dataset.write", rows=table.num_rows, path=path):
+        ds.write_dataset(
+            table, path, format="parquet",
+            partitioning=ds.partitioning(
+                pa.schema([("region", pa.string()), ("year", pa.int16())]), flavor="hive"),
+            existing_data_behavior="delete_matching",
+            max_rows_per_group=row_group_size,
+            min_rows_per_group=min(row_group_size, 1024),
+            basename_template="part-{i}.parquet",
+        )
+
+    with stage("dataset.zonemaps", rows=table.num_rows):
+        _write_zonemaps(data, path)
+
+
+def _partition(region, year):
+    return "region={}/year={}".format(region, int(year))
+
+
+def load_zonemaps(path):
+    """
+    Returns zone maps of dataset partitions; empty dict if dataset has none
+
+    Parameters
+    ----------
+    path: str
+        root directory of dataset
+    """
+    try:
+        with open(os.path.join(path, ZONEMAPS)) as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return dict()
+
+
+def _write_zonemaps(data, path):
+    """
+    Computes zone maps of written partitions & merges them into zone maps of dataset
+    """
+    regions = np.asarray(data["region"]).astype(str)
+    years = np.asarray(data["p2a"], dtype="datetime64[Y]").astype(np.int64) + 1970
+    zonemaps = load_zonemaps(path)
+
+    for region in np.unique(regions):
+        in_region = regions == region
+        for year in np.unique(years[in_region]):
+            rows = np.flatnonzero(in_region & (years == year))
+            part = _partition(region, year)
+            files = sorted(os.listdir(os.path.join(path, part)))
+            zonemaps[part] = {
+                "rows": len(rows),
+                "bytes": sum(os.path.getsize(os.path.join(path, part, f)) for f in files),
+                "files": [part + "/" + f for f in files],
+                "columns": zonemap.build({h: data[h][rows] for h in data if h != "region"}),
+            }
+
+    with open(os.path.join(path, ZONEMAPS), "w") as fp:
+        json.dump(zonemaps, fp)
+
+
+def _open(path, files=None):
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    partitioning = ds.partitioning(
+        pa.schema([("region", pa.string()), ("year", pa.int16())]), flavor="hive")
+    if files is None:
+        return ds.dataset(path, format="parquet", partitioning=partitioning)
+    return ds.dataset([os.path.join(path, f) for f in files], format="parquet",
+                      partitioning=partitioning, partition_base_dir=path)
+
+
+def _expression(predicate):
+    """
+    Returns predicate (see zonemap module) as pyarrow dataset expression
+    """
+    import pyarrow.dataset as ds
+
+    def scalar(name, value):
+        # dates are stored as Parquet dates
+        if name in DataDownloader.headers and \
+                DataDownloader.types[DataDownloader.headers.index(name)].startswith("datetime"):
+            return np.datetime64(value, "D").astype(object)
+        return value
+
+    ops = {
+        "==": lambda f, v: f == v, "!=": lambda f, v: f != v,
+        "<": lambda f, v: f < v, "<=": lambda f, v: f <= v,
+        ">": lambda f, v: f > v, ">=": lambda f, v: f >= v,
+    }
+    expr = None
+    for term in predicate:
+        term_expr = None
+        for name, op, value in (term if isinstance(term, list) else [term]):
+            field = ds.field(name)
+            if op == "in":
+                e = field.isin([scalar(name, v) for v in value])
+            else:
+                e = ops[op](field, scalar(name, value))
+            term_expr = e if term_expr is None else term_expr | e
+        expr = term_expr if expr is None else expr & term_expr
+    return expr
+
+
+def _prune(path, dataset, regions, years, where):
+    """
+    Returns files of selected partitions whose zone maps may match predicate;
+    updates zonemap.counters
+
+    Returns
+    -------
+    tuple
+        (list of files relative to path, n of checked partitions, n of skipped partitions,
+         checked bytes, skipped bytes)
+    """
+    zonemaps = load_zonemaps(path)
+    base = os.path.abspath(path)
+    files = []
+    checked = dict()
+    for f in dataset.files:
+        rel = os.path.relpath(os.path.abspath(f), base).replace(os.sep, "/")
+        part = rel.rsplit("/", 1)[0]
+        keys = dict(p.split("=", 1) for p in part.split("/") if "=" in p)
+        if regions and keys.get("region") not in regions:
+            continue
+        if years and int(keys.get("year", -1)) not in [int(y) for y in years]:
+            continue
+        if part not in checked:
+            # partitions written without zone maps are always read
+            zm = zonemaps.get(part)
+            checked[part] = (zm is None or zonemap.may_match(zm["columns"], where),
+                             zm["bytes"] if zm else 0)
+        if checked[part][0]:
+            files.append(rel)
+
+    skipped = [b for keep, b in checked.values() if not keep]
+    stats = (len(checked), len(skipped), sum(b for _, b in checked.values()), sum(skipped))
+    for name, n in zip(["chunks", "skipped", "bytes", "skipped_bytes"], stats):
+        zonemap.counters[name] += n
+    return (files,) + stats
+
+
+def read_table(path, columns=None, regions=None, years=None, use_threads=True, where=None):
+    """
+    Reads Parquet dataset as pyarrow Table.
+    Only files of selected regions & years and only selected columns are read;
+    partitions whose zone maps rule out predicate `where` are skipped.
+
+    Parameters
+    ----------
+    path: str
+        root directory of dataset
+    columns: list
+        attributes to read; all if missing
+    regions: list
+        region codes to read; all if missing
+    years: list
+        years to read; all if missing
+    use_threads: bool
+        read files & decode columns in parallel
+    where: list
+        predicate on rows to read (see zonemap module); all rows if missing
+
+    Returns
+    -------
+    pyarrow.Table
+        selected data
+    """
+    import pyarrow.dataset as ds
+
+    dataset = _open(path)
+    flt = None
+    if regions:
+        flt = ds.field("region").isin(list(regions))
+    if years:
+        f = ds.field("year").isin([int(y) for y in years])
+        flt = f if flt is None else flt & f
+    if columns is not None:
+        # keep order, drop duplicates
+        columns = list(dict.fromkeys(columns))
+
+    with stage("dataset.read", path=path) as st:
+        if where:
+            with stage("dataset.prune") as pst:
+                files, chunks, skipped, size, skipped_size = _prune(path, dataset, regions, years, where)
+                pst.meta.update(chunks=chunks, skipped=skipped, bytes=size, skipped_bytes=skipped_size)
+            st.meta.update(chunks=chunks, skipped=skipped)
+            if files:
+                dataset = _open(path, files)
+            else:
+                # nothing to read -- keep schema only
+                flt = ds.scalar(False)
+            f = _expression(where)
+            flt = f if flt is None else flt & f
+        table = dataset.to_table(columns=columns, filter=flt, use_threads=use_threads)
+        st.rows = table.num_rows
+    return table
+
+
+def read_dict(path, columns=None, regions=None, years=None, use_threads=True, where=None):
+    """
+    Reads Parquet dataset as dict of numpy arrays, i.e. in format of DataDownloader.
+    See read_table for parameters.
+
+    Returns
+    -------
+    dict
+        dictionary of data entries: {header: np.array(entries)}
+    """
+    table = read_table(path, columns, regions, years, use_threads, where)
+    with stage("dataset.to_numpy", rows=table.num_rows):
+        result = {name: table.column(name).to_numpy() for name in table.column_names
+                  if name != "year" or (columns and "year" in columns)}
+        if "p2a" in result:
+            # same type as produced by DataDownloader
+            result["p2a"] = result["p2a"].astype(DataDownloader.types[DataDownloader.headers.index("p2a")])
+        return result
+
+
+def read_dataframe(path, columns=None, regions=None, years=None, use_threads=True, where=None):
+    """
+    Reads Parquet dataset as pandas DataFrame.
+    See read_table for parameters.
+
+    Returns
+    -------
+    pandas.DataFrame
+        selected data
+    """
+    table = read_table(path, columns, regions, years, use_threads, where)
+    if "year" in table.column_names and not (columns and "year" in columns):
+        table = table.select([c for c in table.column_names if c != "year"])
+    with stage("dataset.to_pandas", rows=table.num_rows):
+        return table.to_pandas(use_threads=use_threads, date_as_object=False)
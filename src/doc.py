@@ -1,7 +1,21 @@
 #!/usr/bin/env python3.9
 # coding=utf-8
 from matplotlib import pyplot as plt
+import numpy as np
 import pandas as pd
+import spill
+from profiling import stage
+
+
+# vehicle type of accident cause (p44)
+VEHICLES = dict.fromkeys((0, 1, 2), "motorcycle") | \
+    dict.fromkeys((3, 4), "car") | \
+    dict.fromkeys((5, 6, 7), "truck") | \
+    {8: "bus"} | \
+    {16: "train"}
+
+# columns of vehicle_sums
+SUM_COLUMNS = ["Accidents", "Deaths", "Severely injured", "Slightly injured", "With injury"]
 
 
 def plot_injuries(df: pd.DataFrame, fig_location: str = None, show_figure: bool = False):
@@ -21,71 +35,131 @@ def plot_injuries(df: pd.DataFrame, fig_location: str = None, show_figure: bool
     """
 
     # get data
-    data = df.loc[(df["p44"] < 9) | (df["p44"] == 16),
-                  ["p44", "p13a", "p13b", "p13c"]].copy()
-    # set vehicle types
-    data["p44"] = data["p44"].map(
-        dict.fromkeys((0, 1, 2), "motorcycle") |
-        dict.fromkeys((3, 4), "car") |
-        dict.fromkeys((5, 6, 7), "truck") |
-        {8: "bus"} |
-        {16: "train"})
-    # set column names
-    data.rename({"p13a": "Deaths", "p13b": "Severely injured",
-                 "p13c": "Slightly injured"}, axis="columns", inplace=True)
-
-    # init plot
-    plt.style.use("ggplot")
-    fig, axs = plt.subplots(2, 1, figsize=(8, 8),
-                            gridspec_kw={'height_ratios': [3, 2]})
-    for ax in axs:
-        ax.xaxis.label.set_visible(False)
-        ax.tick_params(axis="x", labelsize=14)
-    plt.tight_layout()
-
-    # plot by vehicle type
-    dt1 = data.groupby(["p44"]).sum().loc[[
-        "car", "truck", "motorcycle", "bus", "train"]]
-    dt1.plot.bar(ax=axs[0], rot=0,
-                 colormap="autumn", title="Seriousness of injuries")
-    axs[0].set_ylabel("accidents")
-    axs[0].grid(visible=False, axis="x")
-    axs[0].set_yscale("log")
-
-    # plot total count
-    plt.style.use("seaborn-dark")
-    counts = data.value_counts("p44")
-    counts.plot.bar(
-        ax=axs[1], rot=0, color="#6c17bd", title="Lives threatened per accident")
-    axs[1].set_ylabel("accidents", color="#6c17bd")
-    axs[1].tick_params(axis='y', labelcolor="#6c17bd")
-    axs[1].grid(True)
-    axs[1].yaxis.set_ticks(axs[1].get_yticks())  # FixedLocator warning
-    yticks = ['{:.0f}'.format(x) + 'K' for x in axs[1].get_yticks()/1000]
-    axs[1].set_yticklabels(yticks)
-
-    # plot probability of injury
-    ax3 = axs[1].twinx()
-    ax3.tick_params(axis="x", labelsize=14)
-    ax3.set_ylabel("threatened", color="#DC143C")
-    ax3.tick_params(axis='y', labelcolor="#DC143C")
-    dt2 = (dt1["Deaths"] + dt1["Severely injured"]) / data.value_counts("p44")
-    dt2.plot.bar(ax=ax3, color="#DC143C", width=0.2)
-    xlocs, _ = plt.xticks()
-    for index, value in enumerate(dt2.values.tolist()):
-        plt.text(xlocs[index] - 0.12, value + 0.01,
-                 "{:,.2f}".format(value), fontsize=12, fontweight="bold")
-    plt.text(xlocs[-1] - 0.25, 0.025, str(counts.at["train"]),
-             fontsize=14, fontweight="bold", color="#6c17bd")
-    plt.plot([xlocs[-1] - 0.18, xlocs[-1]], [0.018, 0], color="#6c17bd", lw=3)
+    with stage("doc.plot_injuries.aggregate", rows=len(df)):
+        data = df.loc[(df["p44"] < 9) | (df["p44"] == 16),
+                      ["p44", "p13a", "p13b", "p13c"]].copy()
+        # set vehicle types
+        data["p44"] = data["p44"].map(VEHICLES)
+        # set column names
+        data.rename({"p13a": "Deaths", "p13b": "Severely injured",
+                     "p13c": "Slightly injured"}, axis="columns", inplace=True)
+
+        # by vehicle type
+        dt1 = data.groupby(["p44"]).sum().loc[[
+            "car", "truck", "motorcycle", "bus", "train"]]
+        # total count
+        counts = data.value_counts("p44")
+        # probability of injury
+        dt2 = (dt1["Deaths"] + dt1["Severely injured"]) / counts
+
+    with stage("doc.plot_injuries.render", rows=len(data)):
+        # init plot
+        plt.style.use("ggplot")
+        fig, axs = plt.subplots(2, 1, figsize=(8, 8),
+                                gridspec_kw={'height_ratios': [3, 2]})
+        for ax in axs:
+            ax.xaxis.label.set_visible(False)
+            ax.tick_params(axis="x", labelsize=14)
+        plt.tight_layout()
+
+        # plot by vehicle type
+        dt1.plot.bar(ax=axs[0], rot=0,
+                     colormap="autumn", title="Seriousness of injuries")
+        axs[0].set_ylabel("accidents")
+        axs[0].grid(visible=False, axis="x")
+        axs[0].set_yscale("log")
+
+        # plot total count
+        # seaborn styles are prefixed since matplotlib 3.6
+        plt.style.use("seaborn-v0_8-dark" if "seaborn-v0_8-dark" in plt.style.available else "seaborn-dark")
+        counts.plot.bar(
+            ax=axs[1], rot=0, color="#6c17bd", title="Lives threatened per accident")
+        axs[1].set_ylabel("accidents", color="#6c17bd")
+        axs[1].tick_params(axis='y', labelcolor="#6c17bd")
+        axs[1].grid(True)
+        axs[1].yaxis.set_ticks(axs[1].get_yticks())  # FixedLocator warning
+        yticks = ['{:.0f}'.format(x) + 'K' for x in axs[1].get_yticks()/1000]
+        axs[1].set_yticklabels(yticks)
+
+        # plot probability of injury
+        ax3 = axs[1].twinx()
+        ax3.tick_params(axis="x", labelsize=14)
+        ax3.set_ylabel("threatened", color="#DC143C")
+        ax3.tick_params(axis='y', labelcolor="#DC143C")
+        dt2.plot.bar(ax=ax3, color="#DC143C", width=0.2)
+        xlocs, _ = plt.xticks()
+        for index, value in enumerate(dt2.values.tolist()):
+            plt.text(xlocs[index] - 0.12, value + 0.01,
+                     "{:,.2f}".format(value), fontsize=12, fontweight="bold")
+        plt.text(xlocs[-1] - 0.25, 0.025, str(counts.at["train"]),
+                 fontsize=14, fontweight="bold", color="#6c17bd")
+        plt.plot([xlocs[-1] - 0.18, xlocs[-1]], [0.018, 0], color="#6c17bd", lw=3)
 
     # figure storing / showing
     if fig_location:
-        fig.savefig(fig_location)
+        with stage("figure.save", file=fig_location):
+            fig.savefig(fig_location)
     if show_figure:
         plt.show()
 
 
+def _budgeted_vehicle_sums(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Sums accidents & injuries by vehicle type in partitions within memory
+    budget (see spill module). Same result as vehicle_sums without budget.
+    """
+    with stage("doc.budgeted_vehicle_sums", rows=len(df)) as st:
+        sums = spill.GroupSum(1, len(SUM_COLUMNS))
+        with spill.tracked() as mem:
+            for a, b in spill.partitions(len(df), row_bytes=24 * 8):
+                part = {h: np.asarray(df[h].iloc[a:b].to_numpy(), dtype=np.int64)
+                        for h in ["p44", "p13a", "p13b", "p13c"]}
+                keep = np.isin(part["p44"], list(VEHICLES))
+                injured = (part["p13a"] > 0) | (part["p13b"] > 0) | (part["p13c"] > 0)
+                sums.add(part["p44"][keep], np.column_stack((
+                    np.ones(keep.sum()), part["p13a"][keep], part["p13b"][keep], part["p13c"][keep], injured[keep])))
+            keys, values = sums.result()
+        st.meta.update(peak=mem["peak"], held=sums.held_peak, spilled=sums.spilled)
+
+    data = pd.DataFrame(values, columns=SUM_COLUMNS, index=[VEHICLES[k] for k in keys[:, 0]])
+    return data.groupby(level=0).sum().rename_axis("Vehicles")
+
+
+def vehicle_sums(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Sums accidents & injuries by vehicle type.
+    With memory budget set (see spill module), sums are computed in partitions.
+
+    Parameters
+    ----------
+    df: pandas.DataFrame
+        data frame
+
+    Returns
+    -------
+    pandas.DataFrame
+        data frame indexed by vehicle type with columns SUM_COLUMNS
+    """
+
+    if spill.budget is not None:
+        return _budgeted_vehicle_sums(df)
+
+    with stage("doc.vehicle_sums", rows=len(df)):
+        # get data
+        data = df.loc[(df["p44"] < 9) | (df["p44"] == 16),
+                      ["p44", "p13a", "p13b", "p13c"]].copy()
+        # set vehicle types
+        data["p44"] = df["p44"].map(VEHICLES)
+        # set column names
+        data.rename({"p13a": "Deaths", "p13b": "Severely injured",
+                     "p13c": "Slightly injured"}, axis="columns", inplace=True)
+        data["With injury"] = (data["Deaths"] > 0) | (data["Severely injured"] > 0) | (
+            data["Slightly injured"] > 0)
+        data["Accidents"] = 1
+
+        return data.groupby("p44")[SUM_COLUMNS].sum().rename_axis("Vehicles")
+
+
 def plot_table(df: pd.DataFrame, out_location: str = None):
     """
     Plot table with data on accidents & injuries by vehicle type.
@@ -94,62 +168,52 @@ def plot_table(df: pd.DataFrame, out_location: str = None):
     Parameters
     ----------
     df: pandas.DataFrame
-        data frame
+        data frame, or aggregates.Aggregates store
 
     out_location: str
         location for table output
     """
 
-    # get data
-    data = df.loc[(df["p44"] < 9) | (df["p44"] == 16),
-                  ["p44", "p13a", "p13b", "p13c"]].copy()
-    # set vehicle types
-    data["p44"] = df["p44"].map(
-        dict.fromkeys((0, 1, 2), "motorcycle") |
-        dict.fromkeys((3, 4), "car") |
-        dict.fromkeys((5, 6, 7), "truck") |
-        {8: "bus"} |
-        {16: "train"})
-    # set column names
-    data.rename({"p13a": "Deaths", "p13b": "Severely injured",
-                 "p13c": "Slightly injured"}, axis="columns", inplace=True)
-
-    # add injury data
-    table = pd.DataFrame()
-    # n of accidents
-    table["Accidents"] = data.value_counts("p44").rename_axis('Vehicles')
-
-    # % of total
-    total_acc = table["Accidents"].sum()
-    table["Of total acc."] = (
-        table["Accidents"] * 100 / total_acc).map("{:.0f}%".format)
-    # manual fix for better readability
-    table.at["bus", "Of total acc."] = "<2%"
-    table.at["train", "Of total acc."] = "<1%"
-    # % with injury
-    data_inj = data.loc[(data["Deaths"] > 0) | (data["Severely injured"] > 0) | (
-        data["Slightly injured"] > 0)].value_counts("p44") * 100 / table["Accidents"]
-    table["With injury"] = data_inj.map("{:.0f}%".format)
-    # total injured
-    inj_categories = data.groupby(["p44"]).sum().rename_axis('Vehicles')
-    table["Injured"] = inj_categories.sum(axis=1)
-    # of total
-    total = table["Injured"].sum()
-    table["Of total inj."] = (
-        table["Injured"] * 100 / total).map("{:.0f}%".format)
-    table.at["train", "Of total inj."] = "<1%"
-    # by injury category
-    table = pd.concat([table, inj_categories], axis=1)
-    table["Injured per accident"] = table["Injured"] / table["Accidents"]
-    table["Lives threatened per accident"] = (
-        table["Deaths"] + table["Severely injured"]) / table["Accidents"]
+    # sums of accidents & injuries -- from data or from materialised aggregates
+    sums = df.vehicle_sums() if hasattr(df, "vehicle_sums") else vehicle_sums(df)
+
+    with stage("doc.plot_table.aggregate", rows=len(sums)):
+        # add injury data
+        table = pd.DataFrame()
+        # n of accidents
+        table["Accidents"] = sums["Accidents"].sort_values(ascending=False, kind="stable")
+
+        # % of total
+        total_acc = table["Accidents"].sum()
+        table["Of total acc."] = (
+            table["Accidents"] * 100 / total_acc).map("{:.0f}%".format)
+        # manual fix for better readability
+        table.at["bus", "Of total acc."] = "<2%"
+        table.at["train", "Of total acc."] = "<1%"
+        # % with injury
+        data_inj = sums["With injury"] * 100 / table["Accidents"]
+        table["With injury"] = data_inj.map("{:.0f}%".format)
+        # total injured
+        inj_categories = sums[["Deaths", "Severely injured", "Slightly injured"]]
+        table["Injured"] = inj_categories.sum(axis=1)
+        # of total
+        total = table["Injured"].sum()
+        table["Of total inj."] = (
+            table["Injured"] * 100 / total).map("{:.0f}%".format)
+        table.at["train", "Of total inj."] = "<1%"
+        # by injury category
+        table = pd.concat([table, inj_categories], axis=1)
+        table["Injured per accident"] = table["Injured"] / table["Accidents"]
+        table["Lives threatened per accident"] = (
+            table["Deaths"] + table["Severely injured"]) / table["Accidents"]
 
     # table output
     pd.options.display.float_format = '{:,.2f}'.format
     pd.set_option("display.max_rows", None, "display.max_columns", None)
     print(table, "\n")
     if out_location:
-        table.to_csv(out_location, float_format="%.2f")
+        with stage("figure.save", file=out_location):
+            table.to_csv(out_location, float_format="%.2f")
 
     # additional data of interest
     ratio = table.at["bus", "Injured"] / table.at["train", "Injured"]
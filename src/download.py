@@ -11,14 +11,13 @@
 
 import numpy as np
 import zipfile
-import requests
-from bs4 import BeautifulSoup
 import re
 import os
 import csv
-from io import TextIOWrapper
+from io import StringIO
 import gzip
 import pickle
+from profiling import stage
 
 
 class DataDownloader:
@@ -29,16 +28,26 @@ class DataDownloader:
     -----------
         headers
             list of labels of attributes of each entry
+        types
+            list of numpy types of attributes of each entry
         regions
             dictionary of region codes: {region code: file code}
         url
             url of data storage
+        remote_folder
+            folder of data archives at [url]
         folder
             name of folder for storage of tmp files
         cache_filename
             filename of cache file with data of corresponding region
+        cache_format
+            format of cache files, one of [cache_formats]
         data:
             dict containing data in memory: {header: np.array with entries}
+        duplicates
+            dict of number of dropped duplicate entries: {region code: count}
+        skipped
+            dict of archives skipped as fully contained in newer ones: {region code: [archive]}
     """
 
     headers = ["p1", "p36", "p37", "p2a", "weekday(p2a)", "p2b", "p6", "p7", "p8", "p9", "p10", "p11", "p12", "p13a",
@@ -46,6 +55,10 @@ class DataDownloader:
                "p34", "p35", "p39", "p44", "p45a", "p47", "p48a", "p49", "p50a", "p50b", "p51", "p52", "p53", "p55a",
                "p57", "p58", "a", "b", "d", "e", "f", "g", "h", "i", "j", "k", "l", "n", "o", "p", "q", "r", "s", "t", "p5a"]
 
+    # numpy type of each attribute in [headers]; "str" attributes are stored as objects
+    types = ["int"] * 3 + ["datetime64[ns]"] + ["int"] * 41 + \
+        ["str"] * 2 + ["float"] * 2 + ["str"] * 15
+
     regions = {
         "PHA": "00",
         "STC": "01",
@@ -63,7 +76,20 @@ class DataDownloader:
         "KVK": "19",
     }
 
-    def __init__(self, url="https://ehw.fit.vutbr.cz/izv/", folder="data", cache_filename="data_{}.pkl.gz"):
+    remote_folder = "data"
+
+    # cache formats: {format: default cache filename}
+    #   pickle -- gzip-compressed pickle of region dict
+    #   chunks -- column chunks compressed by zstd/lz4/zlib, decompressed in parallel (see colcache)
+    #   mmap   -- uncompressed columns mapped to memory (see colcache)
+    cache_formats = {
+        "pickle": "data_{}.pkl.gz",
+        "chunks": "data_{}.colz",
+        "mmap": "data_{}.cols",
+    }
+
+    def __init__(self, url="https://ehw.fit.vutbr.cz/izv/", folder="data", cache_filename=None,
+                 cache_format="pickle"):
         """
         Parameters
         ----------
@@ -72,31 +98,47 @@ class DataDownloader:
         folder: str
             name of folder for storage of tmp files
         cache_filename: str
-            filename of cache file with data of corresponding region
+            filename of cache file with data of corresponding region;
+            default filename of cache format if missing
+        cache_format: str
+            format of cache files, one of [cache_formats]
         """
+        if cache_format not in self.cache_formats:
+            raise ValueError("unknown cache format: " + str(cache_format))
         self.url = url
         self.folder = folder
-        self.cache_filename = cache_filename
+        self.cache_format = cache_format
+        self.cache_filename = cache_filename or self.cache_formats[cache_format]
         self.data = dict()
+        self.duplicates = dict()
+        self.skipped = dict()
 
     def download_data(self):
         """
         Downloads files (if missing) from [self.url] with entries of traffic accidents.
         Skips all except the most recent files of each year to exclude duplicates.
         """
+        # network & html parsing libs are needed only here --> import on demand
+        import requests
+        from bs4 import BeautifulSoup
+
         # create dir for data
         if not os.path.exists(self.folder):
             os.makedirs(self.folder)
 
         # get html
-        soup = BeautifulSoup(requests.get(self.url).text, "html.parser")
-        p = re.compile("(" + self.folder + "/.*\.zip)")
-
-        # get all buttons with text "ZIP" & extract file paths from onclick calls
-        file_list = [
-            p.search(obj.get("onclick")).group(1)
-            for obj in soup.find_all(class_="btn", string="ZIP")
-        ]
+        with stage("download.scrape", url=self.url) as st:
+            soup = BeautifulSoup(requests.get(self.url).text, "html.parser")
+            # paths of archives on the server, independent of local [self.folder]
+            p = re.compile(r"(" + self.remote_folder + r"/[^'\"]*\.zip)")
+
+            # get all buttons with text "ZIP" & extract file paths from onclick calls
+            matches = [p.search(obj.get("onclick") or "")
+                       for obj in soup.find_all(class_="btn", string="ZIP")]
+            file_list = [m.group(1) for m in matches if m]
+            st.rows = len(file_list)
+            if not file_list:
+                raise ValueError("no data archives found at " + self.url)
 
         # filter files containing data for whole years
         p = re.compile(r".*(?<!\d-)\d{4}\.zip")
@@ -112,15 +154,164 @@ class DataDownloader:
 
         # download data & save to specified dir
         for filename in files:
-            with requests.get(self.url + "/" + filename) as r:
-                with open(filename, "wb") as fp:
-                    for chunk in r.iter_content(chunk_size=128, decode_unicode=True):
-                        fp.write(chunk)
+            with stage("download.fetch", file=filename):
+                with requests.get(self.url + "/" + filename) as r:
+                    with open(os.path.join(self.folder, os.path.basename(filename)), "wb") as fp:
+                        for chunk in r.iter_content(chunk_size=128, decode_unicode=True):
+                            fp.write(chunk)
+
+    def archives(self):
+        """
+        Returns names of downloaded data archives, newest first.
+        Yearly archive is newer than any monthly archive of the same year.
+
+        Returns
+        -------
+        list
+            list of archive filenames
+        """
+        dated = [(self.archive_date(name), name) for name in os.listdir(self.folder)]
+        dated = sorted([d for d in dated if d[0]], reverse=True)
+        return [name for _, name in dated]
+
+    @staticmethod
+    def archive_date(name):
+        """
+        Returns (year, month) of data archive; month of yearly archive is 13.
+        None if name is not a data archive.
+
+        Parameters
+        ----------
+        name: str
+            archive filename, e.g. "datagis2019.zip" or "datagis-06-2020.zip"
+        """
+        m = re.match(r".*?(?:(\d{2})-)?(\d{4})\.zip$", name)
+        if not m:
+            return None
+        return int(m.group(2)), int(m.group(1)) if m.group(1) else 13
+
+    def _read_archive(self, zfile, region):
+        """
+        Returns decoded CSV file of region from data archive
+        """
+        with stage("download.extract", archive=zfile, region=region):
+            with zipfile.ZipFile(self.folder + "/" + zfile, "r") as zf:
+                with zf.open(self.regions[region] + ".csv", "r") as f:
+                    return f.read().decode("cp1250")
+
+    @staticmethod
+    def _scan_ids(text):
+        """
+        Returns IDs (first field) of entries in CSV text without parsing other fields
+        """
+        return np.array([int(line[:line.find(";")].strip('"') or -1)
+                         for line in text.splitlines() if line], dtype=np.int64)
+
+    @staticmethod
+    def _parse_text(text):
+        """
+        Returns list of entries (tuples of str) parsed from CSV text
+        """
+        tmp = csv.reader(StringIO(text), delimiter=";")
+        return [tuple(item.replace(",", ".") if item not in [
+            "", "XX", "A:", "B:", "C:", "D:", "E:", "F:", "G:"] else "-1" for item in row) for row in tmp]
+
+    @classmethod
+    def to_columns(cls, rows, headers=None):
+        """
+        Converts parsed entries to dict of typed columns.
+        Each column is a contiguous np.array of its type,
+        so the arrays may be wrapped by pandas without copying.
+
+        Parameters
+        ----------
+        rows: list
+            list of entries (tuples of str) as returned by _parse_text
+        headers: list
+            attributes to convert; all if missing
+
+        Returns
+        -------
+        dict
+            dictionary of columns: {header: np.array(entries)}
+        """
+        if headers is None:
+            headers = cls.headers
+        result = dict()
+        for h in headers:
+            i = cls.headers.index(h)
+            t = cls.types[i]
+            result[h] = np.array([row[i] for row in rows], dtype=object if t == "str" else t)
+        return result
+
+    @staticmethod
+    def deduplicate(ids):
+        """
+        Returns indices of entries to keep, so that each ID is kept once.
+        Entry from the first part containing the ID wins. Entries with missing ID (-1) are kept.
+
+        Parameters
+        ----------
+        ids: list
+            list of np.arrays of IDs of entries of each part, ordered by priority
+
+        Returns
+        -------
+        np.array
+            sorted indices of kept entries in concatenation of parts
+        """
+        if not ids:
+            return np.array([], dtype=np.int64)
+        flat = np.concatenate(ids)
+        rank = np.repeat(np.arange(len(ids)), [len(i) for i in ids])
+        # sort by ID, then by priority of part --> first of each run wins
+        order = np.lexsort((rank, flat))
+        s = flat[order]
+        first = np.ones(len(s), dtype=bool)
+        first[1:] = (s[1:] != s[:-1]) | (s[1:] < 0)
+        return np.sort(order[first])
+
+    def read_cache(self, filename):
+        """
+        Returns data of region loaded from cache file in [self.cache_format]
+
+        Parameters
+        ----------
+        filename: str
+            path of cache file
+        """
+        if self.cache_format == "pickle":
+            with gzip.open(filename, "rb") as cache:
+                return pickle.load(cache)
+        from colcache import read
+        return read(filename)
+
+    def write_cache(self, filename, data):
+        """
+        Stores data of region to cache file in [self.cache_format]
+
+        Parameters
+        ----------
+        filename: str
+            path of cache file
+        data: dict
+            dictionary of data entries: {header: np.array(entries)}
+        """
+        if self.cache_format == "pickle":
+            with gzip.open(filename, "wb") as cache:
+                pickle.dump(data, cache)
+        else:
+            from colcache import write
+            write(filename, data, codec="none" if self.cache_format == "mmap" else None)
 
     def parse_region_data(self, region):
         """
         Returns parsed data for given region in dict: {header: np.array}.
-        Downloads data files if missing.
+        Entries are sorted by date. Downloads data files if missing.
+        Entries contained in several archives are kept once -- from the newest archive;
+        archives with no new entries are not parsed at all.
+        Counts of dropped duplicates & skipped archives are stored
+        in [self.duplicates] and [self.skipped].
 
         Parameters
         ----------
@@ -136,34 +327,42 @@ class DataDownloader:
         if not os.path.isdir(self.folder) or not os.listdir(self.folder):
             self.download_data()
 
-        data = []
-        reg = self.regions[region] + ".csv"
-        files = os.listdir(self.folder)
-
-        # get files from each year
-        p = re.compile(r".*(?<=\d{4})\.zip")
-        files = list(filter(p.match, files))
-        for zfile in files:
-            # get files from specified region
-            with zipfile.ZipFile(self.folder + "/" + zfile, "r") as zf:
-                with zf.open(reg, "r") as f:
-                    tmp = list(csv.reader(TextIOWrapper(
-                        f, encoding="cp1250"), delimiter=";"))
-                    tmp = [tuple(item.replace(",", ".") if item not in [
-                        "", "XX", "A:", "B:", "C:", "D:", "E:", "F:", "G:"] else "-1" for item in row) for row in tmp]
-                    data += tmp
-
-        dt = np.dtype(
-            "int, int, int, datetime64[D], int, int, int, int, int, int, int, int, int, int, int, int, int, int, int, int, int, int, int, int, int, int, int, int, int, int, int, int, int, int, int, int, int, int, int, int, int, int, int, int, int, str, str, float, float, str, str, str, str, str, str, str, str, str, str, str, str, str, str, str"
-        )
-        # -- convert [list of tuples] to [structured np.array] to get correct types
-        # -- convert [structured np.array] to [2D list], to get rid of tuples
-        # -- convert [2D list] to [np.array] && transpose it for [dictionary]
-        data = np.array((np.array(data, dtype=dt).tolist())).T
-
-        # create dict
-        result = dict(zip(self.headers, np.array(data)))
-        result["region"] = np.full(shape=[len(data.T)], fill_value=region)
+        # newest archives first -- their copies of entries win
+        parts = []
+        ids = []
+        seen = np.array([], dtype=np.int64)
+        self.skipped[region] = []
+        for zfile in self.archives():
+            text = self._read_archive(zfile, region)
+
+            # skip archives whose entries are all contained in newer archives
+            scanned = self._scan_ids(text)
+            if len(scanned) and np.isin(scanned, seen).all():
+                self.skipped[region].append(zfile)
+                continue
+
+            with stage("download.parse", archive=zfile, region=region) as st:
+                tmp = self._parse_text(text)
+                st.rows = len(tmp)
+            parts.append(tmp)
+            ids.append(np.array([int(row[0]) for row in tmp], dtype=np.int64))
+            seen = np.union1d(seen, ids[-1])
+
+        with stage("download.deduplicate", region=region) as st:
+            keep = self.deduplicate(ids)
+            rows = [row for tmp in parts for row in tmp]
+            data = [rows[i] for i in keep]
+            self.duplicates[region] = len(rows) - len(data)
+            st.rows = len(rows)
+            st.meta["dropped"] = self.duplicates[region]
+
+        with stage("download.construct", rows=len(data), region=region):
+            result = self.to_columns(data)
+
+            # sort by date
+            order = np.argsort(result["p2a"], kind="stable")
+            result = {h: col[order] for h, col in result.items()}
+            result["region"] = np.full(shape=[len(order)], fill_value=region)
 
         return result
 
@@ -188,6 +387,7 @@ class DataDownloader:
             if not regions:
                 regions = self.regions.keys()
 
+            parts = []
             for reg in regions:
                 # check for cached data
                 cache_name = self.folder + "/" + \
@@ -195,9 +395,13 @@ class DataDownloader:
                 is_cached = False
                 if os.path.exists(cache_name):
                     try:
-                        with gzip.open(cache_name, "rb") as cache:
-                            tmp = pickle.load(cache)
+                        with stage("cache.read", region=reg, format=self.cache_format) as st:
+                            tmp = self.read_cache(cache_name)
+                            # cache of older version with untyped columns
+                            if tmp["p1"].dtype == object:
+                                raise ValueError("outdated cache")
                             is_cached = True
+                            st.rows = len(tmp["region"])
                     except:
                         # invalid cache file --> is_cached is set to False
                         pass
@@ -207,16 +411,95 @@ class DataDownloader:
                     tmp = self.parse_region_data(reg)
 
                     # create cache & save data
-                    with gzip.open(cache_name, "wb") as cache:
-                        pickle.dump(tmp, cache)
+                    with stage("cache.write", rows=len(tmp["region"]), region=reg, format=self.cache_format):
+                        self.write_cache(cache_name, tmp)
+
+                parts.append(tmp)
+
+            # concatenate once -- one copy of data; single region is kept as loaded
+            # (memory-mapped columns of mmap cache stay mapped)
+            if len(parts) == 1:
+                self.data = parts[0]
+            elif parts:
+                with stage("download.concatenate", rows=sum(len(p["region"]) for p in parts)):
+                    self.data = {k: np.concatenate([p[k] for p in parts]) for k in parts[0]}
+
+        return self.data
+
+    def get_dataframe(self, regions=None):
+        """
+        Returns processed entries for specified regions as DataFrame
+        sharing memory with arrays of [self.data] (see frames.to_dataframe).
+
+        Parameters
+        ----------
+        regions: list
+            list of regions to fetch data for; if missing - all regions
+
+        Returns
+        -------
+        pandas.DataFrame
+            data frame of entries
+        """
+        from frames import to_dataframe
+        return to_dataframe(self.get_dict(regions))
+
+    def get_geodataframe(self, regions=None):
+        """
+        Returns processed entries for specified regions as GeoDataFrame
+        sharing memory with arrays of [self.data] (see frames.to_geodataframe).
+
+        Parameters
+        ----------
+        regions: list
+            list of regions to fetch data for; if missing - all regions
+
+        Returns
+        -------
+        geopandas.GeoDataFrame
+            geo data frame of entries
+        """
+        from frames import to_geodataframe
+        return to_geodataframe(self.get_dict(regions))
+
+    def export_dataset(self, path, regions=None):
+        """
+        Stores processed entries as Parquet dataset partitioned by region & year.
+
+        Parameters
+        ----------
+        path: str
+            root directory of dataset
+        regions: list
+            list of regions to export; if missing - all regions
+        """
+        from dataset import write_dataset
+        write_dataset(self.get_dict(regions), path)
 
-                # append to memory
-                if not self.data:
-                    self.data = tmp
-                else:
-                    self.data = {k: np.concatenate(
-                        (self.data[k], tmp[k])) for k in self.data}
+    def import_dataset(self, path, regions=None, years=None, columns=None, where=None):
+        """
+        Loads entries from Parquet dataset into memory instead of parsing data files.
 
+        Parameters
+        ----------
+        path: str
+            root directory of dataset
+        regions: list
+            list of regions to load; if missing - all regions
+        years: list
+            list of years to load; if missing - all years
+        columns: list
+            list of attributes to load; if missing - all attributes
+        where: list
+            predicate on entries to load (see zonemap module); if missing - all entries
+
+        Returns
+        -------
+        dict
+            dictionary of loaded entries
+        """
+        from dataset import read_dict
+        self.data = read_dict(path, columns, regions, years, where=where)
         return self.data
 
 
@@ -228,3 +511,6 @@ if __name__ == "__main__":
           "entries with", len(data), "attributes")
     print("\nList of attributes:\n\t\t", [key for key in data])
     print("\nList of regions:\n\t\t", np.unique(data["region"]))
+    if dd.duplicates:
+        print("\nDropped duplicates:\n\t\t", dd.duplicates)
+        print("\nSkipped archives:\n\t\t", dd.skipped)
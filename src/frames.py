@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# File: frames.py
+# Brief: Zero-copy adapters from DataDownloader columns to (Geo)DataFrames
+#
+# Project: Data analysis & visualization of traffic accidents
+#
+# Authors: Jakub Bartko    xbartk07@stud.fit.vutbr.cz
+#
+# DataDownloader stores each attribute as contiguous typed np.array.
+# Numeric & date columns are wrapped by pandas (>= 2.0) as they are, so the
+# data exist in memory only once; string columns are converted by pandas.
+
+
+import numpy as np
+import pandas as pd
+import layout
+from profiling import stage
+
+
+def to_dataframe(data: dict) -> pd.DataFrame:
+    """
+    Wraps data arrays as DataFrame without copying numeric & date columns.
+    Data sorted by (region, date), as produced by DataDownloader, get layout attached.
+
+    Parameters
+    ----------
+    data: dict
+        dictionary of data entries: {header: np.array(entries)}
+
+    Returns
+    -------
+    pandas.DataFrame
+        data frame sharing memory with data arrays
+    """
+    with stage("frames.to_dataframe", rows=len(data["region"])):
+        df = pd.DataFrame(data, copy=False)
+        if "p2a" in df:
+            # no copy -- column is datetime64 already
+            df["date"] = df["p2a"]
+        if "region" in df and "date" in df and layout.is_sorted(df):
+            layout.attach(df, layout.build(df))
+    return df
+
+
+def valid_coords(x, y):
+    """
+    Returns mask of valid coordinates -- missing ones are NaN or -1 (DataDownloader placeholder)
+
+    Parameters
+    ----------
+    x: np.array
+        x coordinates
+    y: np.array
+        y coordinates
+    """
+    return np.isfinite(x) & np.isfinite(y) & (x != -1) & (y != -1)
+
+
+def to_geodataframe(data: dict):
+    """
+    Wraps data arrays as GeoDataFrame without copying numeric & date columns.
+    Point geometry is built vectorized from "d" & "e" (EPSG:5514);
+    entries with missing coordinates are kept with empty (None) geometry.
+
+    Parameters
+    ----------
+    data: dict
+        dictionary of data entries: {header: np.array(entries)}
+
+    Returns
+    -------
+    geopandas.GeoDataFrame
+        geo data frame sharing memory with data arrays
+    """
+    import geopandas
+
+    df = to_dataframe(data)
+    with stage("frames.to_geodataframe", rows=len(df)):
+        x, y = np.asarray(data["d"]), np.asarray(data["e"])
+        geometry = geopandas.points_from_xy(x, y, crs="EPSG:5514")
+        valid = valid_coords(x, y)
+        if not valid.all():
+            geometry[~valid] = None
+        gdf = geopandas.GeoDataFrame(df, geometry=geometry, crs="EPSG:5514", copy=False)
+        lay = layout.get(df)
+        if lay is not None:
+            layout.attach(gdf, lay)
+    return gdf
+
+
+if __name__ == "__main__":
+    # self-check: frames share memory with downloaded data
+    from download import DataDownloader
+    data = DataDownloader(folder="../data/").get_dict(["JHM"])
+    df = to_dataframe(data)
+    shared = [h for h in data if np.shares_memory(df[h].to_numpy(), data[h])]
+    print("Columns sharing memory with loader arrays:", len(shared), "of", len(data))
+    assert all(np.shares_memory(df[h].to_numpy(), data[h])
+               for h in data if data[h].dtype.kind in "iufM")
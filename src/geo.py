@@ -7,6 +7,15 @@ import contextily as ctx
 from sklearn.cluster import KMeans
 import sys
 import os
+import layout
+import preview
+import zonemap
+from frames import valid_coords
+from profiling import stage
+
+
+# Stamen tiles are served by Stadia Maps since 2023; xyzservices has no Stamen provider anymore
+BASEMAP = ctx.providers.Stadia.StamenTonerLite
 
 
 def _save_fig(fig_location):
@@ -23,24 +32,82 @@ def _save_fig(fig_location):
         dir = os.path.dirname(fig_location)
         if dir and not os.path.exists(dir):
             os.makedirs(dir)
-        plt.savefig(fig_location)
+        with stage("figure.save", file=fig_location):
+            plt.savefig(fig_location)
     except:
         print("ERROR: Failed to save figure", fig_location, file=sys.stderr)
         sys.exit(1)
 
 
-def make_geo(df: pd.DataFrame) -> geopandas.GeoDataFrame:
+def make_geo(df: pd.DataFrame, columns: list = None, regions: list = None,
+             years: list = None, where: list = None,
+             sample: float = None, boundaries=None) -> geopandas.GeoDataFrame:
     """
-    Create GeoDataFrame
+    Create GeoDataFrame. Entries with missing coordinates are dropped.
+    With region boundaries, entries are validated (see borders.validate):
+    mislabelled ones get region containing their point, ones outside
+    all regions are dropped.
+    For data of DataDownloader, frames.to_geodataframe avoids copying them.
 
     Parameters
     ----------
     df: pandas.DataFrame
-        data
+        data, or root directory of partitioned Parquet dataset to read data from
+
+    columns: list
+        attributes to read from Parquet dataset; all if missing
+
+    regions: list
+        regions to read from Parquet dataset; all if missing
+
+    years: list
+        years to read from Parquet dataset; all if missing
+
+    where: list
+        predicate on rows to keep (see zonemap module); all if missing.
+        Parquet dataset skips partitions which cannot match it, data frame is filtered
+
+    sample: float
+        preview mode -- fraction of stratified sample (see preview module)
+        to use instead of whole data; whole data if missing
+
+    boundaries: geopandas.GeoDataFrame or str
+        region boundaries or path of boundary file (see borders module); not validated if missing
     """
-    df["date"] = pd.to_datetime(df["p2a"])
-    df = df.loc[df["e"].notnull() & df["d"].notnull()]
-    return geopandas.GeoDataFrame(df, geometry=geopandas.points_from_xy(df["d"], df["e"]), crs="EPSG:5514")
+    if isinstance(df, str):
+        from dataset import read_dataframe
+        path = df
+        if columns is not None:
+            columns = list(columns) + ["p2a", "d", "e", "region"]
+
+        def read():
+            return read_dataframe(path, columns, regions, years, where=where)
+
+        if sample and not (columns or regions or years or where):
+            df = preview.load(path, sample, read)
+        else:
+            df = read()
+    elif where:
+        # same rows as from dataset
+        df = df.loc[zonemap.matches(df, where)].reset_index(drop=True)
+    if sample and preview.fraction(df) != sample:
+        df = preview.sample(df, sample)
+    if boundaries is not None:
+        from borders import validate
+        df = validate(df, boundaries, correct=True)
+
+    with stage("geo.construct", rows=len(df)):
+        df["date"] = pd.to_datetime(df["p2a"])
+        mask = valid_coords(df["d"].to_numpy(dtype=float), df["e"].to_numpy(dtype=float))
+        # sort by region & date while filtering, unless already sorted; copy only if needed
+        if not layout.is_sorted(df):
+            df = layout.sort(df, mask)
+        elif not mask.all():
+            df = df.loc[mask]
+        gdf = geopandas.GeoDataFrame(df, geometry=geopandas.points_from_xy(df["d"], df["e"]),
+                                     crs="EPSG:5514", copy=False)
+        layout.attach(gdf, layout.build(gdf))
+        return gdf
 
 
 def plot_geo(gdf: geopandas.GeoDataFrame, fig_location: str = None,
@@ -61,34 +128,46 @@ def plot_geo(gdf: geopandas.GeoDataFrame, fig_location: str = None,
     """
 
     # get data & filter by region, year, road type
-    data = gdf[(gdf["region"] == "JHM") & (gdf["p36"] <= 1) &
-               (gdf["date"].dt.year <= 2020)].to_crs("EPSG:3857")
+    with stage("geo.plot_geo.aggregate", rows=len(gdf)):
+        data = layout.select(gdf, ["JHM"], end="2021-01-01")
+        # single region --> data stay sorted by date
+        data = data[(data["p36"] <= 1) & data.geometry.notna()].to_crs("EPSG:3857")
 
-    # get graph bounds
-    _, miny, maxx, maxy = data.total_bounds
-    minx = 1750000.0    # one entry was assigned the wrong region
+        # get graph bounds -- entries with wrong region are relabelled by make_geo with boundaries
+        minx, miny, maxx, maxy = data.total_bounds
+        if "geo_status" not in data:
+            minx = 1750000.0    # not validated -- one entry was assigned the wrong region
 
     # create figure
-    rows, cols = 3, 2
-    fig, axs = plt.subplots(rows, cols, figsize=(15, 10))
-    colors = ["tab:red", "tab:blue"]
-
-    for r in range(rows):
-        for c in range(cols):
-            axs[r, c].set_title("JHM Region: {} ({})".format(
-                "highway" if c == 0 else "1st class road", 2018 + r))
-            axs[r, c].axis("off")
-            axs[r, c].set_xlim(minx, maxx)
-            axs[r, c].set_ylim(miny, maxy)
-
-            # plot data
-            data[(data["p36"] == c) & (data["date"].dt.year == (2018 + r))
-                 ].plot(ax=axs[r, c], markersize=2, color=colors[c])
-            # plot background map
-            ctx.add_basemap(axs[r, c], crs=data.crs.to_string(), source=ctx.providers.Stamen.TonerLite,
-                            alpha=0.9, zoom=10)
-
-    plt.tight_layout()
+    with stage("geo.plot_geo.render", rows=len(data)):
+        rows, cols = 3, 2
+        fig, axs = plt.subplots(rows, cols, figsize=(15, 10))
+        colors = ["tab:red", "tab:blue"]
+        frac = preview.fraction(gdf)
+        counts = []
+
+        for r in range(rows):
+            year = layout.date_slice(data, "{}-01-01".format(2018 + r), "{}-01-01".format(2019 + r))
+            for c in range(cols):
+                axs[r, c].set_title("JHM Region: {} ({})".format(
+                    "highway" if c == 0 else "1st class road", 2018 + r))
+                axs[r, c].axis("off")
+                axs[r, c].set_xlim(minx, maxx)
+                axs[r, c].set_ylim(miny, maxy)
+
+                # plot data
+                points = year[year["p36"] == c]
+                points.plot(ax=axs[r, c], markersize=2, color=colors[c])
+                counts.append(len(points))
+                # plot background map -- skipped in preview
+                if not frac:
+                    with stage("geo.basemap"):
+                        ctx.add_basemap(axs[r, c], crs=data.crs.to_string(), source=BASEMAP,
+                                        alpha=0.9, zoom=10)
+
+        plt.tight_layout()
+        if frac:
+            preview.annotate(fig, "geo", counts, frac)
 
     # showing / storing figure
     if fig_location:
@@ -116,31 +195,40 @@ def plot_cluster(gdf: geopandas.GeoDataFrame, fig_location: str = None,
     """
 
     # get data & filter by region, road type
-    gdata = gdf[(gdf["region"] == "JHM") & (
-        gdf["p36"] == 1)]["geometry"].to_crs("EPSG:3857")
-    gdata.reset_index(drop=True, inplace=True)
-
-    # get sectors by clustering
-    points = pd.DataFrame(
-        {"x": gdata.centroid.x, "y": gdata.centroid.y})
-    kmeans = KMeans(n_clusters=35, random_state=0)
-    clusters = pd.Series(kmeans.fit_predict(points), name="sector")
-
-    # create geo data frame
-    data = geopandas.GeoDataFrame(
-        data=clusters, geometry=gdata, crs="EPSG:3857")
-    # add number of accidents for each sector
-    data["counts"] = data.groupby(["sector"])["sector"].transform("count")
+    with stage("geo.plot_cluster.aggregate", rows=len(gdf)):
+        gdata = gdf[(gdf["region"] == "JHM") & (gdf["p36"] == 1) &
+                    gdf.geometry.notna()]["geometry"].to_crs("EPSG:3857")
+        gdata.reset_index(drop=True, inplace=True)
+
+        # get sectors by clustering
+        points = pd.DataFrame(
+            {"x": gdata.centroid.x, "y": gdata.centroid.y})
+        kmeans = KMeans(n_clusters=min(35, len(points)), random_state=0)
+        clusters = pd.Series(kmeans.fit_predict(points), name="sector")
+
+        # create geo data frame
+        data = geopandas.GeoDataFrame(
+            data=clusters, geometry=gdata, crs="EPSG:3857")
+        # add number of accidents for each sector
+        data["counts"] = data.groupby(["sector"])["sector"].transform("count")
+        frac = preview.fraction(gdf)
+        if frac:
+            data["counts"] = data["counts"] / frac
 
     # create figure
-    _, ax = plt.subplots(figsize=(12, 8))
-    ax.set_title("Accidents in JHM region on 1st class roads")
-    ax.axis("off")
-    # plot data
-    data.plot(ax=ax, column="sector", cmap="OrRd", markersize=5, legend=True)
-    # plot background map
-    ctx.add_basemap(ax, crs=data.crs,
-                    source=ctx.providers.Stamen.TonerLite, alpha=1, zoom=10)
+    with stage("geo.plot_cluster.render", rows=len(data)):
+        _, ax = plt.subplots(figsize=(12, 8))
+        ax.set_title("Accidents in JHM region on 1st class roads")
+        ax.axis("off")
+        # plot data
+        data.plot(ax=ax, column="sector", cmap="OrRd", markersize=5, legend=True)
+        # plot background map -- skipped in preview
+        if frac:
+            preview.annotate(ax.figure, "cluster", clusters.value_counts().to_numpy(), frac)
+        else:
+            with stage("geo.basemap"):
+                ctx.add_basemap(ax, crs=data.crs,
+                                source=BASEMAP, alpha=1, zoom=10)
 
     # showing / storing figure
     if fig_location:
@@ -150,6 +238,8 @@ def plot_cluster(gdf: geopandas.GeoDataFrame, fig_location: str = None,
 
 
 if __name__ == "__main__":
-    gdf = make_geo(pd.read_pickle("../data/accidents.pkl.gz"))
+    from borders import BOUNDARIES
+    gdf = make_geo(pd.read_pickle("../data/accidents.pkl.gz"),
+                   boundaries=BOUNDARIES if os.path.exists(BOUNDARIES) else None)
     plot_geo(gdf, "geo1.pdf", False)
     plot_cluster(gdf, "geo2.pdf", False)
@@ -11,12 +11,12 @@
 
 import argparse
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.colors as colors
 import os
 from download import DataDownloader
+from profiling import stage, profiled
 
 
+@profiled("get_stat.get_data")
 def get_data(src):
     """
     Extracts data for later plotting from data source
@@ -24,7 +24,8 @@ def get_data(src):
     Params
     ------
     src: dict
-        dictionary representing data entries: {header: np.array(entries)}
+        dictionary representing data entries: {header: np.array(entries)},
+        or aggregates.Aggregates store
 
     Returns
     -------
@@ -33,6 +34,11 @@ def get_data(src):
     """
 
     N = 6   # number of accident types
+
+    # counts are materialised already
+    if hasattr(src, "accident_types"):
+        return src.accident_types(N)
+
     out = []
     regions = []
 
@@ -67,65 +73,72 @@ def plot_stat(data_source,
     Parameters
     ----------
     data_source: dict
-        dictionary of data entries: {header: np.array(entries)}
+        dictionary of data entries: {header: np.array(entries)},
+        or aggregates.Aggregates store
     fig_location: str
         filename for saving of plotted figure
     show_figure: bool
         show plotted figure
     """
 
+    # matplotlib is slow to import --> import only when actually plotting
+    import matplotlib.pyplot as plt
+    import matplotlib.colors as colors
+
     # extract data & list of regions
     data, regions = get_data(data_source)
 
-    type_strs = ["Flashing yellow light", "Traffic light out of order", "Road signs",
-                 "Mobile road signs", "Uncontrolled intersection", "No giving way"]
-    # shift accident types for prettier graph
-    data = np.array(data).T
-    data = np.roll(data, -1, axis=0)
-
-    fig = plt.figure(figsize=(9, 7))
-    plt.subplots_adjust(left=0.3, hspace=0.35)
-
-    ###########################################################
-    # Figure n.1 - counts of accident types per each region
-    ax = fig.add_subplot(2, 1, 1)
-    ax.set_title("Absolute values")
-
-    ax.set_yticks(np.arange(len(type_strs))+0.5)
-    ax.set_yticklabels(type_strs)
-    ax.set_xticks(np.arange(len(regions))+0.5)
-    ax.set_xticklabels(regions)
-    ax.invert_yaxis()
-
-    heatmap = ax.pcolor(data, norm=colors.LogNorm())
-    cb = plt.colorbar(heatmap, shrink=1.1)
-    cb.set_label("Number of accidents")
-
-    ################################################################
-    # Figure n.2 - relative counts of accident types per each region
-    sum = data.sum(axis=1)
-    norm_data = data * 100 / sum[:, np.newaxis]
-    norm_data = np.where(np.isclose(norm_data, 0), np.NaN, norm_data)
-
-    ax = fig.add_subplot(2, 1, 2)
-    ax.set_title("Relatively to causes")
-
-    ax.set_yticks(np.arange(len(type_strs))+0.5)
-    ax.set_yticklabels(type_strs)
-    ax.set_xticks(np.arange(len(regions))+0.5)
-    ax.set_xticklabels(regions)
-    ax.invert_yaxis()
-
-    heatmap = ax.pcolor(norm_data, cmap="plasma", vmin=0, vmax=100)
-    cb = plt.colorbar(heatmap, shrink=1.1)
-    cb.set_label("Portion of accidents due to cause [%]")
+    with stage("get_stat.plot_stat.render", rows=len(regions)):
+        type_strs = ["Flashing yellow light", "Traffic light out of order", "Road signs",
+                     "Mobile road signs", "Uncontrolled intersection", "No giving way"]
+        # shift accident types for prettier graph
+        data = np.array(data).T
+        data = np.roll(data, -1, axis=0)
+
+        fig = plt.figure(figsize=(9, 7))
+        plt.subplots_adjust(left=0.3, hspace=0.35)
+
+        ###########################################################
+        # Figure n.1 - counts of accident types per each region
+        ax = fig.add_subplot(2, 1, 1)
+        ax.set_title("Absolute values")
+
+        ax.set_yticks(np.arange(len(type_strs))+0.5)
+        ax.set_yticklabels(type_strs)
+        ax.set_xticks(np.arange(len(regions))+0.5)
+        ax.set_xticklabels(regions)
+        ax.invert_yaxis()
+
+        heatmap = ax.pcolor(data, norm=colors.LogNorm())
+        cb = plt.colorbar(heatmap, shrink=1.1)
+        cb.set_label("Number of accidents")
+
+        ################################################################
+        # Figure n.2 - relative counts of accident types per each region
+        sum = data.sum(axis=1)
+        norm_data = data * 100 / sum[:, np.newaxis]
+        norm_data = np.where(np.isclose(norm_data, 0), np.nan, norm_data)
+
+        ax = fig.add_subplot(2, 1, 2)
+        ax.set_title("Relatively to causes")
+
+        ax.set_yticks(np.arange(len(type_strs))+0.5)
+        ax.set_yticklabels(type_strs)
+        ax.set_xticks(np.arange(len(regions))+0.5)
+        ax.set_xticklabels(regions)
+        ax.invert_yaxis()
+
+        heatmap = ax.pcolor(norm_data, cmap="plasma", vmin=0, vmax=100)
+        cb = plt.colorbar(heatmap, shrink=1.1)
+        cb.set_label("Portion of accidents due to cause [%]")
 
     ###########################################################
     if fig_location:
         path = os.path.dirname(fig_location)
         if path and not os.path.exists(path):
             os.makedirs(os.path.dirname(fig_location), exist_ok=True)
-        plt.savefig(fig_location)
+        with stage("figure.save", file=fig_location):
+            plt.savefig(fig_location)
     if show_figure:
         plt.show()
 
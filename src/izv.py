@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# File: izv.py
+# Brief: Command-line entry point of the whole pipeline
+#
+# Project: Data analysis & visualization of traffic accidents
+#
+# Authors: Jakub Bartko    xbartk07@stud.fit.vutbr.cz
+#
+# Only argparse is imported at module load. Each subcommand imports the
+# modules it needs, so e.g. `izv.py download` never loads matplotlib,
+# pandas or geopandas. Keep it that way -- see bench/importtime.py.
+
+
+import argparse
+import os
+import sys
+
+
+# figure name: (module, function, default output file, loader)
+FIGURES = {
+    "roadtype": ("analysis", "plot_roadtype", "01_roadtype.png", "df"),
+    "animals": ("analysis", "plot_animals", "02_animals.png", "df"),
+    "conditions": ("analysis", "plot_conditions", "03_conditions.png", "df"),
+    "geo": ("geo", "plot_geo", "geo1.pdf", "gdf"),
+    "cluster": ("geo", "plot_cluster", "geo2.pdf", "gdf"),
+    "injuries": ("doc", "plot_injuries", "injuries.pdf", "raw"),
+    "table": ("doc", "plot_table", "data.csv", "raw"),
+    "stat": ("get_stat", "plot_stat", "stats.png", "dict"),
+}
+
+
+# predicates on rows used by figures (see zonemap module); Parquet datasets
+# are read pruned by them, partitions which cannot match are skipped.
+# Predicate must keep every row the figure reads, not only those it draws --
+# e.g. map extent of geo is taken from JHM rows of all years before 2021
+WHERE = {
+    "animals": [("p58", "==", 5), ("p2a", "<", "2021-01-01")],
+    "conditions": [("p18", "!=", 0)],
+    "geo": [("p36", "<=", 1), ("p2a", "<", "2021-01-01")],
+    "cluster": [("p36", "==", 1)],
+    "injuries": [[("p44", "<", 9), ("p44", "==", 16)]],
+    "table": [[("p44", "<", 9), ("p44", "==", 16)]],
+}
+
+
+# figures which may be plotted from materialised aggregates
+AGGREGATED = ["conditions", "table", "stat"]
+
+
+def _downloader(args):
+    """
+    Returns DataDownloader configured by CL arguments
+    """
+    from download import DataDownloader
+    return DataDownloader(folder=args.folder, cache_format=args.cache_format)
+
+
+def _read_data(path):
+    """
+    Reads pickled DataFrame or partitioned Parquet dataset
+    """
+    if os.path.isdir(path):
+        from dataset import read_dataframe
+        return read_dataframe(path)
+    import pandas as pd
+    return pd.read_pickle(path)
+
+
+def cmd_download(args):
+    """
+    Downloads data archives
+    """
+    _downloader(args).download_data()
+
+
+def cmd_build_cache(args):
+    """
+    Parses data archives & stores cache file of each region
+    """
+    data = _downloader(args).get_dict(args.regions)
+    print("Cached", len(data["region"]), "entries of",
+          len(set(data["region"])), "regions in", args.folder)
+
+
+def cmd_export(args):
+    """
+    Stores parsed data as partitioned Parquet dataset
+    """
+    _downloader(args).export_dataset(args.path, args.regions)
+
+
+def cmd_aggregates(args):
+    """
+    Refreshes materialised aggregates with new or changed archives
+    """
+    from aggregates import Aggregates
+    agg = Aggregates(folder=args.folder)
+    report = agg.refresh()
+    print("Processed {archives} archive(s), parsed {parsed} entries ({changed} changed, "
+          "{withdrawn} withdrawn), removed {removed} archive(s)".format(**report))
+    if args.verify:
+        mismatches = agg.verify()
+        print("Consistent with full recompute" if not mismatches else
+              "{} mismatches, e.g. {}".format(len(mismatches), mismatches[:5]))
+        if mismatches:
+            sys.exit(1)
+
+
+def _boundaries(args):
+    """
+    Returns path of region boundary file; None if there is none
+    """
+    path = args.boundaries or os.path.join(args.folder, "regions.geojson")
+    return path if os.path.exists(path) else None
+
+
+def cmd_validate(args):
+    """
+    Checks that accident coordinates lie in their region
+    """
+    from borders import validate, report
+    boundaries = _boundaries(args)
+    if boundaries is None:
+        print("ERROR: no region boundary file, use --boundaries", file=sys.stderr)
+        sys.exit(1)
+    df = validate(_read_data(args.data), boundaries)
+    print(report(df).to_string())
+
+
+def cmd_stats(args):
+    """
+    Prints counts of accident types per region
+    """
+    from get_stat import get_data
+    data, regions = get_data(_downloader(args).get_dict(args.regions))
+
+    print("{:<6}".format("region") + "".join("{:>8}".format(t) for t in range(len(data[0]))))
+    for reg, counts in zip(regions, data):
+        print("{:<6}".format(reg) + "".join("{:>8}".format(c) for c in counts))
+
+
+def cmd_plot(args):
+    """
+    Plots selected figures
+    """
+    import importlib
+
+    figures = args.figures or list(FIGURES)
+    loaded = dict()
+    dataset = os.path.isdir(args.data)
+
+    def read_raw(sample=None):
+        if sample:
+            import preview
+            return preview.load(args.data, sample, lambda: _read_data(args.data))
+        return _read_data(args.data)
+
+    def load(kind, where=None):
+        # load each representation of data at most once per predicate;
+        # predicate prunes Parquet datasets only -- pickle is read whole anyway
+        where = where if dataset else None
+        key = (kind, repr(where))
+        if key not in loaded:
+            if kind == "dict":
+                loaded[key] = _downloader(args).get_dict(args.regions)
+            elif kind == "raw":
+                if where:
+                    from dataset import read_dataframe
+                    loaded[key] = read_dataframe(args.data, where=where)
+                else:
+                    loaded[key] = read_raw()
+            elif kind == "df":
+                from analysis import get_dataframe
+                loaded[key] = get_dataframe(args.data, sample=args.preview, where=where)
+            elif kind == "gdf":
+                from geo import make_geo
+                source = args.data if where else read_raw(args.preview)
+                loaded[key] = make_geo(source, where=where, sample=args.preview, boundaries=_boundaries(args))
+            elif kind == "agg":
+                from aggregates import Aggregates
+                agg = Aggregates(folder=args.folder)
+                if not agg.manifest:
+                    print("ERROR: no materialised aggregates in {}, run `izv.py aggregates` first".format(args.folder),
+                          file=sys.stderr)
+                    sys.exit(1)
+                loaded[key] = agg
+        return loaded[key]
+
+    for name in figures:
+        module, func, filename, kind = FIGURES[name]
+        plot = getattr(importlib.import_module(module), func)
+        location = os.path.join(args.out, filename) if args.out else None
+        if args.aggregates and name in AGGREGATED:
+            kind = "agg"
+        data = load(kind, WHERE.get(name))
+        if func == "plot_stat":
+            plot(data, fig_location=location, show_figure=args.show)
+        elif func == "plot_table":
+            plot(data, location)
+        else:
+            plot(data, location, args.show)
+
+
+def get_parser():
+    """
+    Returns parser of CL arguments
+    """
+    aparser = argparse.ArgumentParser(
+        prog="izv.py",
+        description="Fetches, processes & plots data of traffic accidents")
+    aparser.add_argument(
+        "--folder",
+        default="../data",
+        help="folder with downloaded archives & cache files"
+    )
+    aparser.add_argument(
+        "--cache-format",
+        # DataDownloader.cache_formats -- not imported at start
+        choices=["pickle", "chunks", "mmap"],
+        default="pickle",
+        help="format of region caches: gzip pickle, compressed column chunks or uncompressed memory-mapped columns"
+    )
+    aparser.add_argument(
+        "--memory-budget",
+        metavar="SIZE",
+        help="memory budget of aggregations, e.g. 256M; partial results beyond it spill to disk"
+    )
+    sub = aparser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("download", help="download data archives")
+    p.set_defaults(func=cmd_download)
+
+    p = sub.add_parser("build-cache", help="parse archives & build region caches")
+    p.add_argument("-r", "--regions", nargs="+",
+                   help="region codes; all regions if missing")
+    p.set_defaults(func=cmd_build_cache)
+
+    p = sub.add_parser("export", help="store data as Parquet dataset partitioned by region & year")
+    p.add_argument("path", help="root directory of dataset")
+    p.add_argument("-r", "--regions", nargs="+",
+                   help="region codes; all regions if missing")
+    p.set_defaults(func=cmd_export)
+
+    p = sub.add_parser("aggregates", help="refresh materialised aggregates with new or changed archives")
+    p.add_argument("--verify", action="store_true",
+                   help="compare aggregates with full recompute")
+    p.set_defaults(func=cmd_aggregates)
+
+    p = sub.add_parser("validate", help="check that accident coordinates lie in their region")
+    p.add_argument("-d", "--data", default="../data/accidents.pkl.gz",
+                   help="data file with accidents DataFrame, or directory of Parquet dataset")
+    p.add_argument("-b", "--boundaries",
+                   help="file with region boundaries; FOLDER/regions.geojson if missing")
+    p.set_defaults(func=cmd_validate)
+
+    p = sub.add_parser("stats", help="print counts of accident types per region")
+    p.add_argument("-r", "--regions", nargs="+",
+                   help="region codes; all regions if missing")
+    p.set_defaults(func=cmd_stats)
+
+    p = sub.add_parser("plot", help="plot figures")
+    p.add_argument("figures", nargs="*", metavar="FIGURE",
+                   help="figures to plot: " + ", ".join(FIGURES) + "; all if missing")
+    p.add_argument("-d", "--data", default="../data/accidents.pkl.gz",
+                   help="data file with accidents DataFrame, or directory of Parquet dataset")
+    p.add_argument("-o", "--out", default="../graphs",
+                   help="folder for storing figures; not stored if empty")
+    p.add_argument("-r", "--regions", nargs="+",
+                   help="region codes for 'stat' figure; all regions if missing")
+    p.add_argument("-a", "--aggregates", action="store_true",
+                   help="plot " + ", ".join(AGGREGATED) + " from materialised aggregates")
+    p.add_argument("-b", "--boundaries",
+                   help="file with region boundaries to validate coordinates of geo figures against; "
+                        "FOLDER/regions.geojson if missing, not validated if there is none")
+    p.add_argument("-p", "--preview", type=float, nargs="?", const=0.1, metavar="FRACTION",
+                   help="plot figures of analysis & geo from stratified sample of data (default 0.1) "
+                        "with scaled counts & error bounds, without basemaps")
+    p.add_argument("-s", "--show", action="store_true",
+                   help="show figures after plotting")
+    p.set_defaults(func=cmd_plot)
+
+    return aparser
+
+
+def main(argv=None):
+    aparser = get_parser()
+    args = aparser.parse_args(argv)
+    # choices don't mix well with optional positional lists --> check manually
+    unknown = [f for f in getattr(args, "figures", []) if f not in FIGURES]
+    if unknown:
+        aparser.error("unknown figure(s): " + ", ".join(unknown))
+    if getattr(args, "preview", None) is not None and not 0 < args.preview <= 1:
+        aparser.error("preview fraction must be in (0, 1]")
+    if args.memory_budget:
+        import spill
+        try:
+            spill.set_budget(args.memory_budget)
+        except ValueError:
+            aparser.error("invalid memory budget: " + args.memory_budget)
+    args.func(args)
+    if args.memory_budget:
+        print(spill.report(), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,467 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# File: layout.py
+# Brief: Region & date sorted layout of accident data with offsets index
+#
+# Project: Data analysis & visualization of traffic accidents
+#
+# Authors: Jakub Bartko    xbartk07@stud.fit.vutbr.cz
+#
+# Rows are stored sorted by (region, date), each region as one contiguous
+# block. Layout keeps row offsets of each region and of each month within
+# a region, so region & date range selections are binary searches over
+# small arrays followed by a slice of the data frame -- no boolean masks
+# over the whole table. Layout is stored next to the data file together
+# with the sort order of rows (unless the file is sorted already) &
+# fingerprint of the file, see load.
+
+
+import hashlib
+import os
+import pickle
+import weakref
+import numpy as np
+import pandas as pd
+from profiling import stage
+
+
+class Layout:
+    """
+    Offsets index of data sorted by (region, date)
+
+    Attributes:
+    -----------
+        regions
+            list of region codes in stored order
+        offsets
+            np.array of region row offsets; rows of regions[i] are offsets[i]:offsets[i+1]
+        months
+            np.array of month of each month block (months since 1970-01)
+        month_offsets
+            np.array of row offsets of month blocks, followed by number of rows
+        rows
+            number of rows of indexed data
+    """
+
+    def __init__(self, regions, offsets, months, month_offsets):
+        self.regions = list(regions)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.months = np.asarray(months, dtype=np.int64)
+        self.month_offsets = np.asarray(month_offsets, dtype=np.int64)
+        self.rows = int(self.offsets[-1]) if len(self.offsets) else 0
+        self._region_idx = {r: i for i, r in enumerate(self.regions)}
+
+    def region_rows(self, region):
+        """
+        Returns (start, stop) rows of region; (0, 0) for unknown region
+        """
+        i = self._region_idx.get(region)
+        if i is None:
+            return 0, 0
+        return int(self.offsets[i]), int(self.offsets[i+1])
+
+    def month_blocks(self, region):
+        """
+        Returns (first, last + 1) month block of region
+        """
+        a, b = self.region_rows(region)
+        j0, j1 = np.searchsorted(self.month_offsets[:-1], [a, b])
+        return int(j0), int(j1)
+
+    def _bound(self, dates, j0, j1, stop, t):
+        # first row of month blocks j0:j1 dated >= t
+        m = t.astype("datetime64[M]").astype(np.int64)
+        k = j0 + int(np.searchsorted(self.months[j0:j1], m))
+        if k >= j1:
+            return stop
+        lo = int(self.month_offsets[k])
+        if self.months[k] == m:
+            # refine within the month
+            hi = int(self.month_offsets[k+1])
+            lo += int(np.searchsorted(dates[lo:hi], t.astype(dates.dtype)))
+        return lo
+
+    def rows_of(self, dates, region, start=None, end=None):
+        """
+        Returns (start, stop) rows of region dated in [start, end)
+
+        Parameters
+        ----------
+        dates: np.array
+            sorted dates of indexed data
+        region: str
+            region code
+        start: np.datetime64
+            first date; unbounded if missing
+        end: np.datetime64
+            date after last date; unbounded if missing
+        """
+        a, b = self.region_rows(region)
+        if a == b or (start is None and end is None):
+            return a, b
+        j0, j1 = self.month_blocks(region)
+        lo = a if start is None else self._bound(dates, j0, j1, b, start)
+        hi = b if end is None else self._bound(dates, j0, j1, b, end)
+        return lo, max(lo, hi)
+
+
+# layouts of data frames: {id(df): (weakref to df, Layout)}
+# kept outside of df.attrs, so derived frames never inherit stale index
+_layouts = dict()
+
+
+def _dates(df):
+    """
+    Returns dates of rows as numpy datetime64 array
+    """
+    col = "date" if "date" in df else "p2a"
+    values = df[col].to_numpy()
+    if values.dtype.kind != "M":
+        values = values.astype("datetime64[D]")
+    return values
+
+
+def _boundaries(values):
+    """
+    Returns indices where value differs from the previous one
+    """
+    return np.flatnonzero(values[1:] != values[:-1]) + 1
+
+
+def is_sorted(df):
+    """
+    Checks whether rows are grouped by region & sorted by date within each region
+
+    Parameters
+    ----------
+    df: pandas.DataFrame
+        data frame
+
+    Returns
+    -------
+    bool
+        True if data frame is sorted
+    """
+    if len(df) < 2:
+        return True
+    regions = df["region"].to_numpy()
+    bounds = _boundaries(regions)
+    # each region in one block
+    if len(bounds) + 1 != len(set(regions[np.r_[0, bounds]])):
+        return False
+    # dates ascending except at region boundaries
+    desc = np.flatnonzero(np.diff(_dates(df)) < np.timedelta64(0)) + 1
+    return bool(np.isin(desc, bounds).all())
+
+
+def order(df, mask=None):
+    """
+    Returns positions of rows of data frame in (region, date) order
+
+    Parameters
+    ----------
+    df: pandas.DataFrame
+        data frame
+    mask: np.array
+        boolean array of rows to keep; all if missing
+    """
+    rows = np.arange(len(df)) if mask is None else np.flatnonzero(mask)
+    regions = df["region"].to_numpy()[rows]
+    dates = _dates(df)[rows]
+    # lexsort: last key is the primary one
+    return rows[np.lexsort((dates, regions.astype(str)))]
+
+
+def sort(df, mask=None, rows=None):
+    """
+    Returns copy of data frame sorted by (region, date) with fresh RangeIndex.
+    Rows may be filtered in the same pass to avoid second copy.
+
+    Parameters
+    ----------
+    df: pandas.DataFrame
+        data frame
+    mask: np.array
+        boolean array of rows to keep; all if missing
+    rows: np.array
+        precomputed order of rows (see order); computed if missing
+    """
+    with stage("layout.sort", rows=len(df)):
+        if rows is None:
+            rows = order(df, mask)
+        return df.take(rows).reset_index(drop=True)
+
+
+def build(df):
+    """
+    Returns offsets index of sorted data frame
+
+    Parameters
+    ----------
+    df: pandas.DataFrame
+        data frame sorted by (region, date)
+    """
+    with stage("layout.build", rows=len(df)):
+        regions = df["region"].to_numpy()
+        n = len(regions)
+        bounds = _boundaries(regions)
+        starts = np.r_[0, bounds] if n else np.array([], dtype=np.int64)
+        offsets = np.r_[starts, n]
+
+        months = _dates(df).astype("datetime64[M]").astype(np.int64)
+        month_starts = np.union1d(starts, _boundaries(months)).astype(np.int64)
+        return Layout([str(r) for r in regions[starts]], offsets,
+                      months[month_starts], np.r_[month_starts, n])
+
+
+def attach(df, layout):
+    """
+    Registers layout of data frame
+
+    Parameters
+    ----------
+    df: pandas.DataFrame
+        data frame sorted by (region, date)
+    layout: Layout
+        offsets index of data frame
+    """
+    key = id(df)
+    _layouts[key] = (weakref.ref(df, lambda _: _layouts.pop(key, None)), layout)
+
+
+def get(df):
+    """
+    Returns layout of data frame; None if data frame has no (valid) layout
+    """
+    entry = _layouts.get(id(df))
+    if entry is None or entry[0]() is not df or entry[1].rows != len(df):
+        return None
+    return entry[1]
+
+
+def ensure(df):
+    """
+    Returns data frame sorted by (region, date) with attached layout.
+    Sorts data frame only if needed.
+
+    Parameters
+    ----------
+    df: pandas.DataFrame
+        data frame
+    """
+    if not is_sorted(df):
+        df = sort(df)
+    attach(df, build(df))
+    return df
+
+
+def fingerprint(path):
+    """
+    Returns hash of names, sizes & modification times of data file, or of data
+    files of dataset directory (files & directories starting with "_" or "."
+    are not data, e.g. _layout.pkl). Files are not read, so it is cheap for
+    any size of data; rewriting a partition in place changes it too.
+
+    Parameters
+    ----------
+    path: str
+        data file or dataset directory
+    """
+    with stage("layout.fingerprint", file=path) as st:
+        h = hashlib.blake2b(digest_size=16)
+        files = [(os.path.basename(path), path)]
+        if os.path.isdir(path):
+            files = []
+            for root, dirs, names in os.walk(path):
+                dirs[:] = [d for d in dirs if not d.startswith(("_", "."))]
+                files += [(os.path.relpath(os.path.join(root, n), path), os.path.join(root, n))
+                          for n in names if not n.startswith(("_", "."))]
+        for name, filename in sorted(files):
+            stat = os.stat(filename)
+            h.update("{}\0{}\0{}\0".format(name, stat.st_size, stat.st_mtime_ns).encode())
+        st.meta["files"] = len(files)
+    return h.hexdigest()
+
+
+def load(index_file, source, read):
+    """
+    Returns data frame sorted by (region, date) with attached layout.
+    Layout is stored to index_file with fingerprint of source; if data are not
+    sorted in source, order of their rows is stored with it, so they are only
+    reordered on later loads, not sorted again. Data are never stored twice.
+    Stored layout (& order) are reused while fingerprint of source matches.
+
+    Parameters
+    ----------
+    index_file: str
+        path of stored layout & order of rows
+    source: str
+        data file or dataset directory
+    read: callable
+        function reading data of source as data frame
+    """
+    fp = fingerprint(source)
+    if os.path.exists(index_file):
+        try:
+            with stage("layout.load", file=index_file):
+                with open(index_file, "rb") as f:
+                    stored = pickle.load(f)
+            if stored["fingerprint"] == fp:
+                df = read()
+                rows = stored["order"]
+                if stored["layout"].rows == len(df) and (rows is None or len(rows) == len(df)):
+                    if rows is not None:
+                        df = sort(df, rows=rows)
+                    attach(df, stored["layout"])
+                    return df
+        except Exception:
+            # invalid index file --> rebuild
+            pass
+
+    df = read()
+    if "region" not in df or ("date" not in df and "p2a" not in df):
+        return df
+    rows = None
+    if not is_sorted(df):
+        rows = order(df)
+        rows = rows.astype(np.int32) if len(rows) < 2 ** 31 else rows
+        df = sort(df, rows=rows)
+    attach(df, build(df))
+    try:
+        with stage("layout.save", file=index_file):
+            with open(index_file + ".tmp", "wb") as f:
+                pickle.dump({"fingerprint": fp, "layout": get(df), "order": rows},
+                            f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(index_file + ".tmp", index_file)
+    except OSError:
+        pass
+    return df
+
+
+def _datetime(value):
+    return None if value is None else np.datetime64(value)
+
+
+def select(df, regions=None, start=None, end=None):
+    """
+    Returns rows of given regions dated in [start, end).
+    Uses layout of data frame if available -- a single region is returned
+    as a slice of data frame; falls back to boolean masks otherwise.
+
+    Parameters
+    ----------
+    df: pandas.DataFrame
+        data frame
+    regions: list
+        region codes; all if missing
+    start: str or np.datetime64
+        first date, e.g. "2018-01-01"; unbounded if missing
+    end: str or np.datetime64
+        date after last date; unbounded if missing
+    """
+    start, end = _datetime(start), _datetime(end)
+    layout = get(df)
+
+    if layout is None:
+        mask = np.ones(len(df), dtype=bool)
+        if regions is not None:
+            mask &= df["region"].isin(regions).to_numpy()
+        if start is not None or end is not None:
+            dates = _dates(df)
+            if start is not None:
+                mask &= dates >= start.astype(dates.dtype)
+            if end is not None:
+                mask &= dates < end.astype(dates.dtype)
+        return df.loc[mask]
+
+    dates = _dates(df) if start is not None or end is not None else None
+    if regions is None:
+        regions = layout.regions
+    slices = [layout.rows_of(dates, r, start, end) for r in regions]
+    slices = [(a, b) for a, b in slices if a < b]
+    if len(slices) == 1:
+        return df.iloc[slices[0][0]:slices[0][1]]
+    if not slices:
+        return df.iloc[0:0]
+    return pd.concat([df.iloc[a:b] for a, b in slices])
+
+
+def date_slice(df, start=None, end=None):
+    """
+    Returns rows dated in [start, end) of data frame. Rows sorted by date
+    (e.g. a single region selected from sorted data) are returned as slice;
+    otherwise falls back to boolean mask.
+
+    Parameters
+    ----------
+    df: pandas.DataFrame
+        data frame
+    start: str or np.datetime64
+        first date; unbounded if missing
+    end: str or np.datetime64
+        date after last date; unbounded if missing
+    """
+    dates = _dates(df)
+    start = None if start is None else _datetime(start).astype(dates.dtype)
+    end = None if end is None else _datetime(end).astype(dates.dtype)
+    # derived frames carry no layout --> check order of dates themselves
+    if len(dates) > 1 and (np.diff(dates) < np.timedelta64(0)).any():
+        mask = np.ones(len(df), dtype=bool)
+        if start is not None:
+            mask &= dates >= start
+        if end is not None:
+            mask &= dates < end
+        return df.loc[mask]
+    a = 0 if start is None else np.searchsorted(dates, start)
+    b = len(df) if end is None else np.searchsorted(dates, end)
+    return df.iloc[a:max(a, b)]
+
+
+def monthly_counts(df, regions, column, values):
+    """
+    Counts rows of each region per month & value of column, using month blocks
+    of layout -- no per-row date arithmetic. Data frame must have layout.
+
+    Parameters
+    ----------
+    df: pandas.DataFrame
+        data frame with layout
+    regions: list
+        region codes
+    column: str
+        column with integer codes
+    values: list
+        codes of column to count; other codes are skipped
+
+    Returns
+    -------
+    tuple
+        (np.array of months since 1970-01 [M], np.array of counts [regions, M, values])
+    """
+    lay = get(df)
+    values = np.asarray(values, dtype=np.int64)
+    order = np.argsort(values)
+    v_sorted = values[order]
+    parts = []
+    for r in regions:
+        a, b = lay.region_rows(r)
+        j0, j1 = lay.month_blocks(r)
+        col = np.asarray(df[column].iloc[a:b].to_numpy(), dtype=np.int64)
+        # month block of each row of the region
+        block = np.repeat(np.arange(j1 - j0), np.diff(lay.month_offsets[j0:j1+1]))
+        pos = np.searchsorted(v_sorted, col).clip(0, len(values) - 1)
+        keep = v_sorted[pos] == col
+        counts = np.bincount(block[keep] * len(values) + order[pos[keep]],
+                             minlength=(j1 - j0) * len(values)).reshape(j1 - j0, len(values))
+        parts.append((lay.months[j0:j1], counts))
+
+    months = [m for m, _ in parts if len(m)]
+    if not months:
+        return np.array([], dtype=np.int64), np.zeros((len(regions), 0, len(values)), dtype=np.int64)
+    first = min(m[0] for m in months)
+    last = max(m[-1] for m in months)
+    result = np.zeros((len(regions), last - first + 1, len(values)), dtype=np.int64)
+    for i, (m, counts) in enumerate(parts):
+        result[i, m - first] += counts
+    return np.arange(first, last + 1), result
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# File: preview.py
+# Brief: Approximate preview of figures from stratified samples of data
+#
+# Project: Data analysis & visualization of traffic accidents
+#
+# Authors: Jakub Bartko    xbartk07@stud.fit.vutbr.cz
+#
+# Sample keeps the same fraction of rows of each (region, year) stratum, so
+# each region & year is represented even at small fractions. Samples are
+# stored next to the data file with its fingerprint (see layout.fingerprint)
+# and reused while the data file, or data files of dataset, are unchanged.
+# Sampled data frame carries the fraction in df.attrs["preview"] -- unlike
+# layout index, it stays valid for any frame derived from the sample.
+# Plots scale counts by 1 / fraction; relative error of a count estimated
+# from k sampled rows is about z * sqrt((1 - fraction) / k).
+
+
+import os
+import sys
+import pickle
+import numpy as np
+import pandas as pd
+from layout import fingerprint
+from profiling import stage
+
+
+# default fraction of rows kept in sample
+FRACTION = 0.1
+
+# z-score of reported error bounds (95 %)
+Z = 1.96
+
+
+def sample(df: pd.DataFrame, frac: float = FRACTION, seed: int = 0) -> pd.DataFrame:
+    """
+    Returns stratified sample of data: fraction of rows of each (region, year),
+    at least one row of each. Rows keep their order.
+
+    Parameters
+    ----------
+    df: pandas.DataFrame
+        data frame with region & p2a columns
+    frac: float
+        fraction of rows to keep, in (0, 1]
+    seed: int
+        seed of random generator; same seed gives same sample
+
+    Returns
+    -------
+    pandas.DataFrame
+        sampled data frame with fraction in attrs["preview"]
+    """
+    if not 0 < frac <= 1:
+        raise ValueError("sample fraction must be in (0, 1]")
+
+    with stage("preview.sample", rows=len(df)) as st:
+        years = pd.to_datetime(df["p2a"]).dt.year.to_numpy()
+        _, strata = np.unique(np.rec.fromarrays(
+            (df["region"].to_numpy().astype(str), years)), return_inverse=True)
+        strata = strata.ravel()
+        sizes = np.bincount(strata)
+
+        # rows of each stratum in random order, strata one after another
+        rng = np.random.default_rng(seed)
+        order = np.lexsort((rng.random(len(df)), strata))
+        rank = np.arange(len(df)) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+        keep = np.maximum(1, np.rint(sizes * frac)).astype(np.int64)
+        rows = np.sort(order[rank < np.repeat(keep, sizes)])
+
+        result = df.take(rows).reset_index(drop=True)
+        result.attrs["preview"] = frac
+        st.rows = len(result)
+    return result
+
+
+def sample_file(filename: str, frac: float) -> str:
+    """
+    Returns path of stored sample of data file or dataset directory
+    """
+    if os.path.isdir(filename):
+        return os.path.join(filename, "_preview-{:g}.pkl".format(frac))
+    return "{}.preview-{:g}.pkl".format(filename, frac)
+
+
+def load(filename: str, frac: float, read) -> pd.DataFrame:
+    """
+    Returns stratified sample of data file. Sample is stored next to the
+    data file & reused until the data file changes.
+
+    Parameters
+    ----------
+    filename: str
+        data file or dataset directory
+    frac: float
+        fraction of rows to keep
+    read: callable
+        function reading the whole data, used only if there is no valid sample
+
+    Returns
+    -------
+    pandas.DataFrame
+        sampled data frame with fraction in attrs["preview"]
+    """
+    path = sample_file(filename, frac)
+    fp = fingerprint(filename)
+    if os.path.exists(path):
+        try:
+            with stage("preview.load", file=path):
+                with open(path, "rb") as f:
+                    stored = pickle.load(f)
+            if stored["fingerprint"] == fp:
+                df = stored["data"]
+                df.attrs["preview"] = frac
+                return df
+        except Exception:
+            # invalid sample --> draw it again
+            pass
+
+    df = sample(read(), frac)
+    try:
+        with open(path + ".tmp", "wb") as f:
+            pickle.dump({"fingerprint": fp, "data": df}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + ".tmp", path)
+    except OSError:
+        pass
+    return df
+
+
+def fraction(df) -> float:
+    """
+    Returns sample fraction of data frame; None for exact (whole) data
+    """
+    return getattr(df, "attrs", {}).get("preview")
+
+
+def error_bound(counts, frac: float) -> np.array:
+    """
+    Returns relative error bounds of counts estimated from sample
+
+    Parameters
+    ----------
+    counts: np.array
+        numbers of sampled rows
+    frac: float
+        sample fraction
+
+    Returns
+    -------
+    np.array
+        relative half-widths of confidence intervals (Z); inf for zero counts
+    """
+    counts = np.asarray(counts, dtype=float)
+    with np.errstate(divide="ignore"):
+        return Z * np.sqrt((1 - frac) / counts)
+
+
+def scale_axis(ax, factor: float, axis: str = "y"):
+    """
+    Labels ticks of plotted sample counts with counts scaled to whole data
+    """
+    from matplotlib.ticker import FuncFormatter
+
+    formatter = FuncFormatter(lambda v, _: "{:g}".format(v * factor))
+    axis = ax.yaxis if axis == "y" else ax.xaxis
+    axis.set_major_formatter(formatter)
+    if axis.get_scale() == "log":
+        # log axis labels minor ticks too
+        axis.set_minor_formatter(formatter)
+
+
+def annotate(fig, name: str, counts, frac: float):
+    """
+    Marks figure as preview & reports error bounds of its counts
+
+    Parameters
+    ----------
+    fig: matplotlib.figure.Figure
+        plotted figure
+    name: str
+        name of figure
+    counts: np.array
+        numbers of sampled rows of plotted counts
+    frac: float
+        sample fraction
+    """
+    counts = np.asarray(counts)
+    bounds = error_bound(counts[counts > 0], frac)
+    if len(bounds):
+        text = "PREVIEW: {:g} % sample, counts scaled x{:g}, error (95 %): median ±{:.0f} %, max ±{:.0f} %".format(
+            frac * 100, 1 / frac, np.median(bounds) * 100, bounds.max() * 100)
+    else:
+        text = "PREVIEW: {:g} % sample, no data".format(frac * 100)
+    fig.text(0.01, 0.005, text, fontsize=8, color="tab:red", ha="left", va="bottom")
+    print(name + ":", text, file=sys.stderr)
+
+
+if __name__ == "__main__":
+    df = load("../data/accidents.pkl.gz", FRACTION, lambda: pd.read_pickle("../data/accidents.pkl.gz"))
+    print("Sample of", len(df), "rows,", FRACTION * 100, "% of data")
@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# File: profiling.py
+# Brief: Timing & memory instrumentation of pipeline stages
+#
+# Project: Data analysis & visualization of traffic accidents
+#
+# Authors: Jakub Bartko    xbartk07@stud.fit.vutbr.cz
+
+
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from functools import wraps
+
+
+class _NullStage:
+    """
+    Shared stand-in for a stage record used while profiling is disabled.
+    Attributes set on it are simply discarded by the next caller.
+    """
+
+    rows = None
+
+    @property
+    def meta(self):
+        # fresh dict each time --> nothing accumulates in shared instance
+        return {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class Stage:
+    """
+    Record of a single execution of a pipeline stage
+
+    Attributes:
+    -----------
+        name
+            name of the stage, e.g. "download.parse"
+        rows
+            number of rows processed by the stage (set by the caller)
+        meta
+            dict of additional info on the stage, e.g. {"region": "JHM"}
+        start
+            wall clock start relative to profiler start [s]
+        wall
+            wall time [s]
+        cpu
+            process CPU time [s]
+        peak
+            peak traced memory allocated during the stage [B]
+        depth
+            nesting level of the stage
+        thread
+            identifier of thread the stage ran in
+    """
+
+    __slots__ = ("name", "rows", "meta", "start", "wall", "cpu", "peak", "depth", "thread",
+                 "_profiler", "_wall0", "_cpu0", "_mem0")
+
+    def __init__(self, profiler, name, rows=None, meta=None):
+        self._profiler = profiler
+        self.name = name
+        self.rows = rows
+        self.meta = meta or {}
+        self.start = self.wall = self.cpu = 0.0
+        self.peak = 0
+        self.depth = 0
+        self.thread = threading.get_ident()
+
+    def __enter__(self):
+        self._profiler._push(self)
+        return self
+
+    def __exit__(self, *exc):
+        self._profiler._pop(self)
+        return False
+
+    def to_dict(self):
+        """
+        Returns stage record as JSON serializable dict
+        """
+        return {
+            "name": self.name,
+            "rows": self.rows,
+            "start": self.start,
+            "wall": self.wall,
+            "cpu": self.cpu,
+            "peak": self.peak,
+            "depth": self.depth,
+            "thread": self.thread,
+            "meta": self.meta,
+        }
+
+
+class Profiler:
+    """
+    Collects timing & memory records of pipeline stages
+
+    Attributes:
+    -----------
+        enabled
+            stages are recorded only when set
+        memory
+            trace peak memory of stages using tracemalloc
+        records
+            list of finished stage records
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.memory = False
+        self.records = []
+        self._origin = time.perf_counter()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # tracing started by this profiler, not by the interpreter or caller
+        self._tracing = False
+
+    def enable(self, memory=True):
+        """
+        Starts recording of stages
+
+        Parameters
+        ----------
+        memory: bool
+            trace peak memory of stages (slows allocations down noticeably)
+        """
+        self.memory = memory
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._tracing = True
+        self._origin = time.perf_counter()
+        self.enabled = True
+
+    def disable(self):
+        """
+        Stops recording of stages; already collected records are kept.
+        Memory tracing is stopped only if it was started by enable.
+        """
+        self.enabled = False
+        if self._tracing and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self._tracing = False
+        self.memory = False
+
+    def reset(self):
+        """
+        Drops all collected records
+        """
+        with self._lock:
+            self.records = []
+
+    def stage(self, name, rows=None, **meta):
+        """
+        Returns context manager measuring the enclosed block as a stage.
+        Number of processed rows may be set later via its `rows` attribute.
+
+        Parameters
+        ----------
+        name: str
+            name of the stage
+        rows: int
+            number of processed rows, if known upfront
+        meta:
+            additional info stored with the record
+        """
+        if not self.enabled:
+            return _NULL_STAGE
+        return Stage(self, name, rows, meta)
+
+    def _stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _push(self, st):
+        stack = self._stack()
+        st.depth = len(stack)
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            # peak counter is shared by nested stages --> hand it over to enclosing stages before reset
+            for parent in stack:
+                parent.peak = max(parent.peak, peak - parent._mem0)
+            tracemalloc.reset_peak()
+            st._mem0 = current
+        stack.append(st)
+        st._cpu0 = time.process_time()
+        st._wall0 = time.perf_counter()
+
+    def _pop(self, st):
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        stack = self._stack()
+        if stack and stack[-1] is st:
+            stack.pop()
+        st.start = st._wall0 - self._origin
+        st.wall = wall - st._wall0
+        st.cpu = cpu - st._cpu0
+        if self.memory and tracemalloc.is_tracing():
+            st.peak = max(st.peak, tracemalloc.get_traced_memory()[1] - st._mem0)
+            for parent in stack:
+                parent.peak = max(parent.peak, st.peak + st._mem0 - parent._mem0)
+        with self._lock:
+            self.records.append(st)
+
+    def to_json(self, filename):
+        """
+        Stores collected records as JSON list
+
+        Parameters
+        ----------
+        filename: str
+            path of output file
+        """
+        with open(filename, "w") as fp:
+            json.dump([r.to_dict() for r in self.records], fp, indent=1, default=str)
+
+    def to_chrome_trace(self, filename):
+        """
+        Stores collected records in Chrome trace event format,
+        viewable in chrome://tracing or Perfetto
+
+        Parameters
+        ----------
+        filename: str
+            path of output file
+        """
+        pid = os.getpid()
+        events = []
+        for r in self.records:
+            args = {"cpu_ms": r.cpu * 1e3, "peak_mb": r.peak / (1024*1024)}
+            if r.rows is not None:
+                args["rows"] = r.rows
+            args.update(r.meta)
+            events.append({
+                "name": r.name,
+                "ph": "X",
+                "ts": r.start * 1e6,
+                "dur": r.wall * 1e6,
+                "pid": pid,
+                "tid": r.thread,
+                "args": args,
+            })
+        with open(filename, "w") as fp:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, fp, default=str)
+
+    def summary(self, file=sys.stderr):
+        """
+        Prints records aggregated per stage name
+
+        Parameters
+        ----------
+        file: file object
+            output stream
+        """
+        totals = dict()
+        for r in self.records:
+            t = totals.setdefault(r.name, [0, 0.0, 0.0, 0, 0])
+            t[0] += 1
+            t[1] += r.wall
+            t[2] += r.cpu
+            t[3] += r.rows or 0
+            t[4] = max(t[4], r.peak)
+
+        print("{:<40} {:>5} {:>10} {:>10} {:>10} {:>10}".format(
+            "stage", "calls", "wall [s]", "cpu [s]", "rows", "peak [MB]"), file=file)
+        for name, (calls, wall, cpu, rows, peak) in sorted(totals.items(), key=lambda t: t[1][1], reverse=True):
+            print("{:<40} {:>5} {:>10.3f} {:>10.3f} {:>10} {:>10.1f}".format(
+                name, calls, wall, cpu, rows, peak / (1024*1024)), file=file)
+
+
+# profiler shared by all modules of the project
+profiler = Profiler()
+
+
+def stage(name, rows=None, **meta):
+    """
+    Returns context manager measuring the enclosed block using shared profiler.
+    See Profiler.stage
+    """
+    if not profiler.enabled:
+        return _NULL_STAGE
+    return Stage(profiler, name, rows, meta)
+
+
+def profiled(name):
+    """
+    Decorator measuring each call of the function as a stage
+
+    Parameters
+    ----------
+    name: str
+        name of the stage
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return func(*args, **kwargs)
+            with Stage(profiler, name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _dump_at_exit(json_file, trace_file):
+    if json_file:
+        profiler.to_json(json_file)
+    if trace_file:
+        profiler.to_chrome_trace(trace_file)
+    profiler.summary()
+
+
+# enable profiling of whole run via environment:
+#   IZV_PROFILE=stages.json     -- JSON records
+#   IZV_TRACE=stages.trace.json -- Chrome trace
+#   IZV_PROFILE_MEMORY=0        -- skip tracemalloc
+if os.environ.get("IZV_PROFILE") or os.environ.get("IZV_TRACE"):
+    profiler.enable(memory=os.environ.get("IZV_PROFILE_MEMORY", "1") != "0")
+    atexit.register(_dump_at_exit, os.environ.get("IZV_PROFILE"), os.environ.get("IZV_TRACE"))
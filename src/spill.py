@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# File: spill.py
+# Brief: Memory-budgeted group-by aggregations spilling to disk
+#
+# Project: Data analysis & visualization of traffic accidents
+#
+# Authors: Jakub Bartko    xbartk07@stud.fit.vutbr.cz
+#
+# With a memory budget set, aggregations of plots run over partitions of
+# rows sized to the budget. Partial sums of each partition are kept in
+# memory until they exceed half of the budget; then they are split into
+# buckets by hash of key and appended to temporary files. Result is merged
+# bucket by bucket from the files mapped to memory, so only one bucket of
+# partial sums is processed at a time.
+#
+# Budget is set by set_budget, or for the whole run via environment:
+#   IZV_MEMORY_BUDGET=256M
+# Without budget, plots aggregate the whole data at once as before.
+#
+# Budget bounds partitions & partial sums held in memory, not the whole
+# process: merged result (one row per group of all buckets), partitions of
+# at least 1024 rows and temporaries of pandas & numpy are not bounded by
+# it. Reported peak is memory really allocated by budgeted aggregations,
+# traced by tracemalloc (see tracked), so it may exceed the budget.
+
+
+import contextlib
+import os
+import shutil
+import tempfile
+import tracemalloc
+import numpy as np
+from profiling import profiler, stage
+
+
+# memory budget [B]; None -- no budget
+budget = None
+
+# number of buckets of spilled partial sums
+BUCKETS = 16
+
+# accounting since start of program: peak of allocated memory [B] (see tracked),
+# peak of partial sums held in memory [B], spilled bytes & number of spills
+counters = {"peak": 0, "held": 0, "spilled": 0, "spills": 0}
+
+
+def parse_size(size) -> int:
+    """
+    Returns size in bytes of size given as int or string with unit, e.g. "256M"
+
+    Parameters
+    ----------
+    size: int or str
+        size; units K, M, G (powers of 1024)
+    """
+    if isinstance(size, str):
+        size = size.strip().upper().rstrip("B")
+        units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+        if size and size[-1] in units:
+            return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
+
+
+def set_budget(size):
+    """
+    Sets memory budget of aggregations
+
+    Parameters
+    ----------
+    size: int or str
+        budget, see parse_size; None for no budget
+    """
+    global budget
+    budget = None if size is None else parse_size(size)
+    if budget is not None and budget <= 0:
+        raise ValueError("memory budget must be positive")
+
+
+def partitions(n_rows: int, row_bytes: int):
+    """
+    Yields (start, stop) of row partitions whose working set fits into budget
+
+    Parameters
+    ----------
+    n_rows: int
+        number of rows
+    row_bytes: int
+        memory needed to process one row [B]
+    """
+    size = n_rows if budget is None else max(1024, budget // (2 * max(1, row_bytes)))
+    for start in range(0, n_rows, max(1, size)):
+        yield start, min(n_rows, start + size)
+
+
+@contextlib.contextmanager
+def tracked():
+    """
+    Measures peak of memory allocated in the block by tracemalloc; yields dict
+    whose "peak" [B] is set on exit & added to counters. Tracing is started
+    if not running yet (slows allocations down -- budgeted runs only).
+    """
+    result = {"peak": 0}
+    if profiler.enabled and profiler.memory and tracemalloc.is_tracing():
+        # profiler stages reset peak of tracemalloc --> let profiler track it
+        st = profiler.stage("spill.tracked")
+        try:
+            with st:
+                yield result
+        finally:
+            result["peak"] = st.peak
+            counters["peak"] = max(counters["peak"], st.peak)
+        return
+
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    # peak is not reset -- it may be measured by caller (e.g. bench/plots.py)
+    base = tracemalloc.get_traced_memory()[0]
+    try:
+        yield result
+    finally:
+        result["peak"] = max(0, tracemalloc.get_traced_memory()[1] - base)
+        counters["peak"] = max(counters["peak"], result["peak"])
+        if started:
+            tracemalloc.stop()
+
+
+class GroupSum:
+    """
+    Sums of values per key computed in partitions within memory budget
+
+    Attributes:
+    -----------
+        n_keys
+            number of key columns
+        n_values
+            number of value columns
+        held_peak
+            peak of memory held by partial sums & processed partition [B];
+            own accounting, see tracked for memory really allocated
+        spilled
+            bytes of partial sums written to disk
+    """
+
+    def __init__(self, n_keys: int, n_values: int):
+        self.n_keys = n_keys
+        self.n_values = n_values
+        self.held_peak = 0
+        self.spilled = 0
+        self._parts = []
+        self._held = 0
+        self._dir = None
+
+    @staticmethod
+    def _reduce(rows, n_keys):
+        """
+        Returns rows [key..., value...] with unique keys, values summed, sorted by key
+        """
+        if not len(rows):
+            return rows
+        uniq, inverse = np.unique(rows[:, :n_keys], axis=0, return_inverse=True)
+        sums = np.zeros((len(uniq), rows.shape[1] - n_keys), dtype=np.int64)
+        np.add.at(sums, inverse.ravel(), rows[:, n_keys:])
+        return np.column_stack((uniq, sums))
+
+    def add(self, keys, values):
+        """
+        Adds values of rows of one partition
+
+        Parameters
+        ----------
+        keys: np.array
+            integer keys [n, n_keys]
+        values: np.array
+            integer values [n, n_values]
+        """
+        rows = np.column_stack((np.asarray(keys, dtype=np.int64).reshape(-1, self.n_keys),
+                                np.asarray(values, dtype=np.int64).reshape(-1, self.n_values)))
+        part = self._reduce(rows, self.n_keys)
+        self.held_peak = max(self.held_peak, self._held + rows.nbytes + part.nbytes)
+        self._parts.append(part)
+        self._held += part.nbytes
+        if budget is not None and self._held > budget // 2:
+            self._spill()
+
+    def _file(self, bucket):
+        return os.path.join(self._dir, "bucket-{}.bin".format(bucket))
+
+    def _spill(self):
+        """
+        Appends partial sums held in memory to bucket files
+        """
+        if not self._parts:
+            return
+        with stage("spill.write", rows=sum(len(p) for p in self._parts)) as st:
+            if self._dir is None:
+                self._dir = tempfile.mkdtemp(prefix="izv-spill-")
+            rows = np.concatenate(self._parts)
+            self._parts, self._held = [], 0
+            # bucket by hash of key
+            bucket = (rows[:, :self.n_keys] * (np.arange(self.n_keys) * 2 + 1000003)).sum(axis=1) % BUCKETS
+            for b in np.unique(bucket):
+                with open(self._file(b), "ab") as fp:
+                    rows[bucket == b].tofile(fp)
+            self.spilled += rows.nbytes
+            counters["spilled"] += rows.nbytes
+            counters["spills"] += 1
+            st.meta["bytes"] = rows.nbytes
+
+    def result(self):
+        """
+        Returns summed values per key; removes spilled files
+
+        Returns
+        -------
+        tuple
+            (np.array of keys [g, n_keys], np.array of sums [g, n_values]), sorted by key
+        """
+        width = self.n_keys + self.n_values
+        if self._dir is None:
+            rows = self._reduce(np.concatenate(self._parts) if self._parts
+                                else np.zeros((0, width), dtype=np.int64), self.n_keys)
+        else:
+            self._spill()
+            merged = []
+            with stage("spill.merge", bytes=self.spilled):
+                try:
+                    for b in range(BUCKETS):
+                        if not os.path.exists(self._file(b)):
+                            continue
+                        data = np.memmap(self._file(b), dtype=np.int64, mode="r").reshape(-1, width)
+                        # bucket is merged in slices of the budget
+                        acc = np.zeros((0, width), dtype=np.int64)
+                        step = max(1024, (budget or 0) // (4 * width * 8))
+                        for start in range(0, len(data), step):
+                            acc = self._reduce(np.concatenate((acc, data[start:start + step])), self.n_keys)
+                            self.held_peak = max(self.held_peak, sum(m.nbytes for m in merged) +
+                                                 2 * acc.nbytes + min(step, len(data)) * width * 8)
+                        del data
+                        merged.append(acc)
+                finally:
+                    shutil.rmtree(self._dir, ignore_errors=True)
+                    self._dir = None
+            rows = np.concatenate(merged) if merged else np.zeros((0, width), dtype=np.int64)
+            # buckets hold disjoint keys --> sort only
+            rows = rows[np.lexsort(rows[:, :self.n_keys].T[::-1])]
+
+        self._parts, self._held = [], 0
+        counters["held"] = max(counters["held"], self.held_peak)
+        return rows[:, :self.n_keys], rows[:, self.n_keys:]
+
+
+def report() -> str:
+    """
+    Returns summary of memory accounting of budgeted aggregations
+    """
+    return ("memory budget {:.1f} MB: peak {:.1f} MB allocated ({:.1f} MB partial sums), "
+            "{:.1f} MB spilled in {} spill(s)").format(
+        (budget or 0) / (1024*1024), counters["peak"] / (1024*1024), counters["held"] / (1024*1024),
+        counters["spilled"] / (1024*1024), counters["spills"])
+
+
+if os.environ.get("IZV_MEMORY_BUDGET"):
+    set_budget(os.environ["IZV_MEMORY_BUDGET"])
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# File: synthetic.py
+# Brief: Synthetic accident data in format of DataDownloader & of its archives
+#
+# Project: Data analysis & visualization of traffic accidents
+#
+# Authors: Jakub Bartko    xbartk07@stud.fit.vutbr.cz
+#
+# Shared by benchmarks (bench/) & tests (tests/), so both follow the
+# format of parsed data defined by DataDownloader.headers & types.
+
+
+import zipfile
+import numpy as np
+from download import DataDownloader
+
+
+# approximate centres of regions in EPSG:5514 [m]
+CENTRES = {
+    "PHA": (-743000, -1045000), "STC": (-720000, -1065000), "JHC": (-760000, -1160000),
+    "PLK": (-830000, -1095000), "ULK": (-765000, -990000), "HKK": (-630000, -1010000),
+    "JHM": (-590000, -1170000), "MSK": (-470000, -1110000), "OLK": (-540000, -1090000),
+    "ZLK": (-520000, -1165000), "VYS": (-640000, -1125000), "PAK": (-620000, -1060000),
+    "LBK": (-690000, -980000), "KVK": (-850000, -1020000),
+}
+
+# ranges of attribute codes [low, high); attributes not listed get [0, 10)
+CODES = {
+    "p36": (0, 9), "p10": (0, 8), "p18": (0, 8), "p21": (0, 7), "p24": (0, 6), "p58": (1, 7),
+}
+
+# vehicle types (p44), as in the source data
+VEHICLE_CODES = np.r_[np.arange(0, 19), -1]
+
+
+def synthetic(rows, seed=0):
+    """
+    Returns synthetic data in format of DataDownloader, sorted by (region, date):
+    valid attribute codes, dates of 2016-2021 & EPSG:5514 coordinates
+    around centre of each region; 5 % of entries miss coordinates
+
+    Parameters
+    ----------
+    rows: int
+        number of entries
+    seed: int
+        seed of random generator
+    """
+    rng = np.random.default_rng(seed)
+    regions = np.array(list(CENTRES))
+    region = np.sort(rng.choice(regions, rows))
+    dates = np.datetime64("2016-01-01") + rng.integers(0, 6 * 365, rows).astype("timedelta64[D]")
+    # sort by date within region
+    order = np.lexsort((dates, region))
+    region, dates = region[order], dates[order]
+
+    data = dict()
+    for header, kind in zip(DataDownloader.headers, DataDownloader.types):
+        if header == "p1":
+            data[header] = np.arange(rows, dtype=np.int64)
+        elif header == "p2a":
+            data[header] = dates.astype(kind)
+        elif header == "p44":
+            data[header] = rng.choice(VEHICLE_CODES, rows)
+        elif header in ("p13a", "p13b", "p13c"):
+            data[header] = rng.poisson({"p13a": 0.01, "p13b": 0.05, "p13c": 0.3}[header], rows)
+        elif header in ("d", "e"):
+            present, idx = np.unique(region, return_inverse=True)
+            centre = np.array([CENTRES[r][header == "e"] for r in present], dtype=float)
+            data[header] = centre[idx.ravel()] + rng.normal(0, 15000, rows)
+        elif kind == "int":
+            data[header] = rng.integers(*CODES.get(header, (0, 10)), rows)
+        elif kind == "float":
+            data[header] = rng.random(rows)
+        else:
+            data[header] = rng.choice(np.array(["", "A", "B"], dtype=object), rows)
+
+    missing = rng.random(rows) < 0.05
+    data["d"][missing] = data["e"][missing] = -1
+    data["region"] = region.astype(object)
+    return data
+
+
+def csv_line(p1, date, **values):
+    """
+    Returns CSV line of entry as in data archives; attributes not given are 0
+
+    Parameters
+    ----------
+    p1: int
+        ID of entry
+    date: str
+        date of entry (p2a), e.g. "2020-07-01"
+    values:
+        other attributes, e.g. p18=1
+    """
+    fields = dict.fromkeys(DataDownloader.headers, 0)
+    fields.update(values, p1=p1, p2a=date)
+    return ";".join('"{}"'.format(fields[h]) for h in DataDownloader.headers)
+
+
+def write_archive(filename, lines):
+    """
+    Stores data archive with CSV file of each region; regions not given are empty
+
+    Parameters
+    ----------
+    filename: str
+        path of archive, e.g. "data/datagis2020.zip"
+    lines: dict
+        CSV lines of entries of regions: {region code: [csv_line]}
+    """
+    with zipfile.ZipFile(filename, "w") as zf:
+        for region, code in DataDownloader.regions.items():
+            zf.writestr(code + ".csv", "\r\n".join(lines.get(region, [])).encode("cp1250"))
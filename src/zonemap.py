@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# File: zonemap.py
+# Brief: Per-chunk column statistics (zone maps) for skipping data
+#
+# Project: Data analysis & visualization of traffic accidents
+#
+# Authors: Jakub Bartko    xbartk07@stud.fit.vutbr.cz
+#
+# For each chunk (region & year partition of dataset) and each column, the
+# zone map stores min, max, number of nulls and -- for small integer codes --
+# bitset of distinct values. A predicate is checked against zone maps before
+# reading; chunks that cannot contain a matching row are skipped.
+#
+# Predicate is a list of terms that must all hold (AND); a term is either
+# a clause (column, op, value) or a list of clauses of which one must hold (OR):
+#   [("p36", "<=", 1)]
+#   [[("p44", "<", 9), ("p44", "==", 16)], ("p2a", ">=", "2018-01-01")]
+# Supported ops: ==, !=, <, <=, >, >=, in
+# Data which are not stored with zone maps (e.g. pickled DataFrame) are
+# filtered by the same predicate row by row, see matches.
+
+
+import operator
+import numpy as np
+
+
+# integer codes in [-1, BITSET_MAX] get distinct-value bitset
+BITSET_MAX = 62
+
+# counters of pruning since start of program
+counters = {"chunks": 0, "skipped": 0, "bytes": 0, "skipped_bytes": 0}
+
+
+def column_stats(values):
+    """
+    Returns zone map of column values
+
+    Parameters
+    ----------
+    values: np.array
+        column values
+
+    Returns
+    -------
+    dict
+        {"kind", "min", "max", "nulls", "bits"}; min & max are None for all-null column,
+        bits is None if column is not small integer codes
+    """
+    values = np.asarray(values)
+    kind = values.dtype.kind
+    stats = {"kind": kind, "min": None, "max": None, "nulls": 0, "bits": None}
+
+    if kind in "iu":
+        # -1 is placeholder of missing value
+        stats["nulls"] = int(np.count_nonzero(values == -1))
+    elif kind == "f":
+        stats["nulls"] = int(np.count_nonzero(np.isnan(values) | (values == -1)))
+        values = values[~np.isnan(values)]
+    elif kind == "M":
+        nat = np.isnat(values)
+        stats["nulls"] = int(np.count_nonzero(nat))
+        values = values[~nat].astype("datetime64[ns]").astype(np.int64)
+    else:
+        missing = np.array([v is None or v == "" for v in values], dtype=bool)
+        stats["nulls"] = int(np.count_nonzero(missing))
+        values = values[~missing].astype(str).tolist()
+        if values:
+            stats["min"], stats["max"] = min(values), max(values)
+        return stats
+
+    if len(values):
+        lo, hi = values.min(), values.max()
+        stats["min"], stats["max"] = lo.item(), hi.item()
+        if kind in "iu" and lo >= -1 and hi <= BITSET_MAX:
+            bits = 0
+            for v in np.unique(values).tolist():
+                bits |= 1 << (v + 1)
+            stats["bits"] = bits
+    return stats
+
+
+def build(columns):
+    """
+    Returns zone maps of all columns of a chunk
+
+    Parameters
+    ----------
+    columns: dict
+        {column name: np.array of values}
+
+    Returns
+    -------
+    dict
+        {column name: zone map (see column_stats)}
+    """
+    return {name: column_stats(values) for name, values in columns.items()}
+
+
+def _value(stats, value):
+    # predicate value in representation of zone map
+    if stats["kind"] == "M":
+        return np.datetime64(value, "ns").astype(np.int64).item()
+    if stats["kind"] not in "iuf":
+        return str(value)
+    return value
+
+
+def _any_bit(bits, lo, hi):
+    # any distinct value x with lo <= x <= hi
+    lo = min(max(int(lo), -1), BITSET_MAX + 1)
+    hi = min(max(int(hi), -2), BITSET_MAX)
+    if hi < lo:
+        return False
+    return bits >> (lo + 1) & ((1 << (hi - lo + 1)) - 1) != 0
+
+
+def clause_may_match(stats, op, value):
+    """
+    Checks whether some row of chunk may satisfy clause
+
+    Parameters
+    ----------
+    stats: dict
+        zone map of column
+    op: str
+        comparison operator
+    value:
+        compared value; list of values for "in"
+
+    Returns
+    -------
+    bool
+        False only if no row of chunk can satisfy the clause
+    """
+    if stats["min"] is None:
+        # only nulls -- cannot be judged
+        return True
+    lo, hi, bits = stats["min"], stats["max"], stats["bits"]
+
+    if op == "in":
+        return any(clause_may_match(stats, "==", v) for v in value)
+    v = _value(stats, value)
+    if op == "==":
+        if not lo <= v <= hi:
+            return False
+        if bits is not None:
+            return float(v).is_integer() and bool(bits >> (int(v) + 1) & 1)
+        return True
+    if op == "!=":
+        # NaN is out of min & max but differs from any value
+        return not (lo == hi == v) or (stats["kind"] == "f" and stats["nulls"] > 0)
+    if op == "<":
+        return lo < v and (bits is None or _any_bit(bits, -1, np.ceil(v) - 1))
+    if op == "<=":
+        return lo <= v and (bits is None or _any_bit(bits, -1, np.floor(v)))
+    if op == ">":
+        return hi > v and (bits is None or _any_bit(bits, np.floor(v) + 1, BITSET_MAX))
+    if op == ">=":
+        return hi >= v and (bits is None or _any_bit(bits, np.ceil(v), BITSET_MAX))
+    raise ValueError("unsupported operator: " + op)
+
+
+def may_match(zonemap, predicate):
+    """
+    Checks whether some row of chunk may satisfy predicate
+
+    Parameters
+    ----------
+    zonemap: dict
+        zone maps of chunk columns
+    predicate: list
+        predicate (see module description)
+
+    Returns
+    -------
+    bool
+        False only if no row of chunk can satisfy the predicate
+    """
+    for term in predicate:
+        clauses = term if isinstance(term, list) else [term]
+        # unknown column --> cannot be judged
+        if not any(c[0] not in zonemap or clause_may_match(zonemap[c[0]], c[1], c[2]) for c in clauses):
+            return False
+    return True
+
+
+def columns(predicate):
+    """
+    Returns names of columns used in predicate
+    """
+    names = []
+    for term in predicate:
+        for c in (term if isinstance(term, list) else [term]):
+            if c[0] not in names:
+                names.append(c[0])
+    return names
+
+
+
+# comparison operators of clauses
+OPS = {"==": operator.eq, "!=": operator.ne, "<": operator.lt,
+       "<=": operator.le, ">": operator.gt, ">=": operator.ge}
+
+
+def _clause_matches(values, op, value):
+    # boolean mask of values satisfying clause; dates may be given as strings
+    if op == "in":
+        return np.logical_or.reduce([_clause_matches(values, "==", v) for v in value] +
+                                    [np.zeros(len(values), dtype=bool)])
+    if op not in OPS:
+        raise ValueError("unsupported operator: " + op)
+    if isinstance(value, (str, np.datetime64)) and values.dtype.kind in "MOU":
+        try:
+            value, values = np.datetime64(value, "ns"), values.astype("datetime64[ns]")
+        except ValueError:
+            # not a date -- compare as strings
+            value = str(value)
+    return np.asarray(OPS[op](values, value), dtype=bool)
+
+
+def matches(columns, predicate):
+    """
+    Returns rows satisfying predicate -- same rows as dataset.read_table
+    keeps when reading with the predicate
+
+    Parameters
+    ----------
+    columns: pandas.DataFrame or dict
+        columns of data: {name: array of values}
+    predicate: list
+        predicate (see module description)
+
+    Returns
+    -------
+    np.array
+        boolean mask of rows
+    """
+    mask = np.ones(len(columns[next(iter(columns))]), dtype=bool)
+    for term in predicate:
+        clauses = term if isinstance(term, list) else [term]
+        mask &= np.logical_or.reduce([_clause_matches(np.asarray(columns[c[0]]), c[1], c[2])
+                                      for c in clauses])
+    return mask
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# File: test_aggregates.py
+# Brief: Tests of incremental refresh of aggregates on synthetic archives
+#
+# Project: Data analysis & visualization of traffic accidents
+#
+# Authors: Jakub Bartko    xbartk07@stud.fit.vutbr.cz
+
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import pytest
+from aggregates import Aggregates
+from synthetic import csv_line, write_archive
+
+
+@pytest.fixture
+def folder(tmp_path):
+    # entries 1-3 in yearly archive, 3 & 4 in monthly archive of next year
+    write_archive(tmp_path / "datagis2019.zip", {"JHM": [
+        csv_line(1, "2019-02-01", p18=1, p24=1, p44=3),
+        csv_line(2, "2019-05-01", p18=1, p24=2, p44=3),
+        csv_line(3, "2019-12-01", p18=1, p24=2, p44=3)]})
+    write_archive(tmp_path / "datagis-03-2020.zip", {"JHM": [
+        csv_line(3, "2019-12-01", p18=1, p24=2, p44=3),
+        csv_line(4, "2020-03-01", p18=2, p24=2, p44=3, p13c=1)]})
+    agg = Aggregates(folder=str(tmp_path))
+    agg.refresh()
+    assert agg.verify() == []
+    return tmp_path
+
+
+def _refresh(folder):
+    # store is reloaded, as by next run of `izv.py aggregates`
+    agg = Aggregates(folder=str(folder))
+    report = agg.refresh()
+    assert agg.verify() == []
+    return agg, report
+
+
+def test_new_archive(folder):
+    write_archive(folder / "datagis-04-2020.zip", {"JHM": [
+        csv_line(4, "2020-03-01", p18=2, p24=2, p44=3, p13c=1),
+        csv_line(5, "2020-04-01", p18=3, p24=1, p44=1)], "PHA": [csv_line(6, "2020-04-02", p18=1)]})
+    agg, report = _refresh(folder)
+    # only new entries are parsed
+    assert report["archives"] == 1 and report["parsed"] == 2
+    assert agg.tables["types"][(Aggregates.regions.index("JHM"), 1)] == (2,)
+
+
+def test_changed_line(folder):
+    write_archive(folder / "datagis-03-2020.zip", {"JHM": [
+        csv_line(3, "2019-12-01", p18=4, p24=2, p44=3),
+        csv_line(4, "2020-03-01", p18=2, p24=2, p44=3, p13c=1)]})
+    os.utime(folder / "datagis-03-2020.zip", ns=(1, 1))
+    agg, report = _refresh(folder)
+    assert report["parsed"] == 1 and report["changed"] == 1
+
+
+def test_unchanged_copy_is_not_overridden(folder):
+    # yearly archive re-published with older version of entry 3 --> copy of newer archive wins
+    write_archive(folder / "datagis2019.zip", {"JHM": [
+        csv_line(1, "2019-02-01", p18=1, p24=1, p44=3),
+        csv_line(2, "2019-05-01", p18=1, p24=2, p44=3),
+        csv_line(3, "2019-12-01", p18=6, p24=2, p44=3)]})
+    os.utime(folder / "datagis2019.zip", ns=(1, 1))
+    _refresh(folder)
+
+
+def test_removed_archive(folder):
+    os.remove(folder / "datagis-03-2020.zip")
+    agg, report = _refresh(folder)
+    assert report["removed"] == 1
+    assert sorted(agg.ledger["p1"].tolist()) == [1, 2, 3]
+
+
+def test_withdrawn_entry(folder):
+    # entry 4 withdrawn, entry 3 changed
+    write_archive(folder / "datagis-03-2020.zip", {"JHM": [
+        csv_line(3, "2019-12-01", p18=2, p24=3, p44=3)]})
+    os.utime(folder / "datagis-03-2020.zip", ns=(1, 1))
+    agg, report = _refresh(folder)
+    assert report["withdrawn"] == 1 and report["changed"] == 1
+    assert sorted(agg.ledger["p1"].tolist()) == [1, 2, 3]
+
+    # entry 3 withdrawn too --> version of yearly archive is counted again
+    write_archive(folder / "datagis-03-2020.zip", {"JHM": []})
+    os.utime(folder / "datagis-03-2020.zip", ns=(2, 2))
+    agg, report = _refresh(folder)
+    assert report["withdrawn"] == 1
+    assert sorted(agg.ledger["p1"].tolist()) == [1, 2, 3]
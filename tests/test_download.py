@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# File: test_download.py
+# Brief: Tests of deduplication of overlapping data archives on synthetic archives
+#
+# Project: Data analysis & visualization of traffic accidents
+#
+# Authors: Jakub Bartko    xbartk07@stud.fit.vutbr.cz
+
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import numpy as np
+from download import DataDownloader
+from synthetic import csv_line, write_archive
+
+
+def test_deduplicate_first_part_wins():
+    keep = DataDownloader.deduplicate([np.array([5, -1]), np.array([6, 5, -1])])
+    # second copy of 5 dropped, entries with missing ID kept
+    assert keep.tolist() == [0, 1, 2, 4]
+
+
+def test_overlapping_archives(tmp_path):
+    # newest first: 03-2021, yearly 2020, 06-2020
+    write_archive(tmp_path / "datagis-03-2021.zip", {"JHM": [
+        csv_line(3, "2020-12-01", p18=5), csv_line(4, "2021-03-01", p18=1)]})
+    write_archive(tmp_path / "datagis2020.zip", {"JHM": [
+        csv_line(1, "2020-02-01", p18=1), csv_line(2, "2020-06-01", p18=1), csv_line(3, "2020-12-01", p18=1)]})
+    # fully contained in yearly archive of the same year
+    write_archive(tmp_path / "datagis-06-2020.zip", {"JHM": [
+        csv_line(1, "2020-02-01", p18=2), csv_line(2, "2020-06-01", p18=2)]})
+
+    dd = DataDownloader(folder=str(tmp_path))
+    data = dd.parse_region_data("JHM")
+
+    assert sorted(data["p1"].tolist()) == [1, 2, 3, 4]
+    p18 = dict(zip(data["p1"].tolist(), data["p18"].tolist()))
+    # copy of newest archive wins
+    assert p18 == {1: 1, 2: 1, 3: 5, 4: 1}
+    assert dd.skipped["JHM"] == ["datagis-06-2020.zip"]
+    # copy of 3 in yearly archive; skipped archive isn't parsed, so not counted
+    assert dd.duplicates["JHM"] == 1
+    # sorted by date
+    assert (np.diff(data["p2a"]) >= np.timedelta64(0)).all()
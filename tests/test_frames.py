@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# File: test_frames.py
+# Brief: Tests of zero-copy adapters of frames module on synthetic data
+#
+# Project: Data analysis & visualization of traffic accidents
+#
+# Authors: Jakub Bartko    xbartk07@stud.fit.vutbr.cz
+
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import numpy as np
+import pytest
+import layout
+from frames import to_dataframe, to_geodataframe
+from synthetic import synthetic
+
+
+def _typed(data):
+    return [h for h in data if data[h].dtype.kind in "iufM"]
+
+
+def test_dataframe_shares_memory():
+    data = synthetic(1000)
+    df = to_dataframe(data)
+    assert _typed(data)
+    for h in _typed(data):
+        assert np.shares_memory(df[h].to_numpy(), data[h]), h
+    # date column is the loader's array too
+    assert np.shares_memory(df["date"].to_numpy(), data["p2a"])
+    assert layout.get(df) is not None
+
+
+def test_geodataframe_shares_memory():
+    pytest.importorskip("geopandas")
+    data = synthetic(1000)
+    gdf = to_geodataframe(data)
+    for h in _typed(data):
+        assert np.shares_memory(gdf[h].to_numpy(), data[h]), h
+    assert gdf.geometry.isna().sum() == (data["d"] == -1).sum() > 0
+    assert layout.get(gdf) is not None
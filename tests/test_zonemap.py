@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# File: test_zonemap.py
+# Brief: Tests that predicates select the same rows from pickle & Parquet dataset
+#
+# Project: Data analysis & visualization of traffic accidents
+#
+# Authors: Jakub Bartko    xbartk07@stud.fit.vutbr.cz
+
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import pytest
+from frames import to_dataframe
+from synthetic import synthetic
+
+
+@pytest.mark.parametrize("where", [
+    [("p36", "<=", 1), ("p2a", "<", "2021-01-01")],
+    [[("p44", "<", 9), ("p44", "==", 16)]],
+    [("p18", "!=", 0), ("region", "in", ["JHM", "PHA"])],
+])
+def test_pickle_matches_dataset(tmp_path, where):
+    pytest.importorskip("pyarrow")
+    from analysis import get_dataframe
+    from dataset import write_dataset
+
+    data = synthetic(3000)
+    write_dataset(data, str(tmp_path / "ds"))
+    to_dataframe(data).drop(columns="date").to_pickle(tmp_path / "data.pkl")
+
+    from_pickle = get_dataframe(str(tmp_path / "data.pkl"), where=where)
+    from_dataset = get_dataframe(str(tmp_path / "ds"), where=where)
+    assert 0 < len(from_pickle) < len(data["p1"])
+    assert sorted(from_pickle["p1"]) == sorted(from_dataset["p1"])